@@ -0,0 +1,51 @@
+"""Scalar calc_eta loop vs calc_eta_batch.
+
+    python benchmarks/bench_delivery_eta.py [destinations]
+
+Warms both up once (the batch path imports numpy lazily), checks they give
+identical results, then reports the time for each.
+"""
+import random
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from utils import calc_eta, calc_eta_batch  # noqa: E402
+
+
+def _destinations(n: int, seed: int = 1) -> list[tuple[float, float, list]]:
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        items = [SimpleNamespace(id=rnd.randint(1, 40), qty=rnd.randint(1, 5)) for _ in range(rnd.randint(1, 6))]
+        out.append((rnd.uniform(41.0, 75.0), rnd.uniform(20.0, 180.0), items))
+    return out
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    dests = _destinations(n)
+    # Warm-up: calc_eta_batch imports numpy on first use; keep that out of the timings
+    lat, lon, items = dests[0]
+    calc_eta(items, lat, lon)
+    calc_eta_batch(dests[:1])
+
+    start = time.perf_counter()
+    scalar = [calc_eta(items, lat, lon) for lat, lon, items in dests]
+    scalar_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = calc_eta_batch(dests)
+    batch_s = time.perf_counter() - start
+
+    assert batch == scalar, "batch results differ from calc_eta"
+    print(f"{n} destinations")
+    print(f"scalar calc_eta: {scalar_s * 1000:.1f} ms ({n / scalar_s:,.0f}/s)")
+    print(f"calc_eta_batch:  {batch_s * 1000:.1f} ms ({n / batch_s:,.0f}/s), {scalar_s / batch_s:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Login throughput through the bcrypt process pool.
+
+    python benchmarks/bench_password_hashing.py [logins] [rounds]
+
+Fires `logins` concurrent verify calls the way /token does and reports
+logins/sec overall and per worker core.
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import passwords  # noqa: E402
+from config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS  # noqa: E402
+
+
+async def _bench(logins: int, hashed: str, rounds: int) -> float:
+    await passwords.verify_and_update_async("secret", hashed, rounds)  # warm the pool
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(passwords.verify_and_update_async("secret", hashed, rounds) for _ in range(logins))
+    )
+    elapsed = time.perf_counter() - start
+    # A rehash would add a second bcrypt per login to the numbers
+    assert all(ok and new_hash is None for ok, new_hash in results)
+    return elapsed
+
+
+def main() -> None:
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else BCRYPT_ROUNDS
+    # Same min/max pinning as the app's context, just at the requested cost
+    hashed = passwords._context(rounds).hash("secret")
+    try:
+        elapsed = asyncio.run(_bench(logins, hashed, rounds))
+    finally:
+        passwords.close_password_pool()
+    rate = logins / elapsed
+    print(f"bcrypt cost {rounds}, {PASSWORD_HASH_WORKERS} workers, {logins} logins in {elapsed:.2f}s")
+    print(f"{rate:.1f} logins/sec, {rate / PASSWORD_HASH_WORKERS:.1f} logins/sec per core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""JSON rendering and compression for the heaviest payloads.
+
+    python benchmarks/bench_responses.py [orders]
+
+Before: stdlib JSONResponse, uncompressed. After: FastJSONResponse (orjson)
+plus gzip/brotli at the middleware settings. Covers /products (real catalog),
+an /admin/orders page and a /my-orders list of `orders` synthetic orders.
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from catalog import build_products  # noqa: E402
+from responses import FastJSONResponse, compress  # noqa: E402
+from schemas import OrderItemOut, OrderOut  # noqa: E402
+
+
+def _orders(n: int) -> list[dict]:
+    return [
+        {
+            "id": i,
+            "order_id": f"ORD-17000000{i:05d}-{i % 900 + 100}",
+            "address": "г. Новосибирск, ул. Ленина, д. 1, кв. 10",
+            "items": [{"id": 3278 + k, "name": "VIBE Tee Off-White", "price": 3990, "qty": 1 + k} for k in range(3)],
+            "amount": 3990 * 6,
+            "created_at": "2025-01-01T12:00:00.000000",
+            "geo_lat": "55.0084",
+            "geo_lon": "82.9357",
+            "username": "alice",
+        }
+        for i in range(n)
+    ]
+
+
+def _my_orders(n: int) -> list[dict]:
+    out = []
+    for o in _orders(n):
+        m = OrderOut(
+            order_id=o["order_id"],
+            address=o["address"],
+            amount=o["amount"],
+            created_at=o["created_at"],
+            items=[OrderItemOut(**it) for it in o["items"]],
+            payment_status="succeeded",
+            payment_card_last4="1111",
+            payment_card_brand="visa",
+            payment_created_at=o["created_at"],
+        )
+        out.append(m.model_dump())
+    return out
+
+
+def _time(fn, repeat: int = 20) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    payloads = {"/products": build_products(), "/admin/orders": _orders(n), "/my-orders": _my_orders(n)}
+    for name, content in payloads.items():
+        stdlib_s = _time(lambda: JSONResponse(content))
+        fast_s = _time(lambda: FastJSONResponse(content))
+        body = FastJSONResponse(content).body
+        gzip_s = _time(lambda: compress(body, "gzip"))
+        br_s = _time(lambda: compress(body, "br"))
+        print(f"{name}: {len(body):,} bytes")
+        print(f"  render   json {stdlib_s * 1000:7.2f} ms   orjson {fast_s * 1000:7.2f} ms   ({stdlib_s / fast_s:.1f}x)")
+        print(f"  gzip {len(compress(body, 'gzip')):>9,} bytes in {gzip_s * 1000:6.2f} ms")
+        print(f"  br   {len(compress(body, 'br')):>9,} bytes in {br_s * 1000:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import threading
+
+import orjson
+
+import db
+from db import sqlite_conn
+from images import IMAGES_URL_PREFIX, hashed_url, image_index
+from responses import compress
+from variants import variant_index
+
+
+def product_rows(con) -> list:
+    return con.execute(
+        "SELECT id, position, slug, name, price, description, extra FROM products ORDER BY position, id"
+    ).fetchall()
+
+
+def product_item(row, images_map: dict[str, list[str]]) -> dict:
+    """Public dict for one products row (products.json shape plus id/slug/image)."""
+    pid, _, slug, name, price, description, extra = row
+    item = {"name": name, "price": price, "description": description, **json.loads(extra or "{}")}
+    imgs = images_map.get(str(pid)) or item.get("images") or []
+    if imgs:
+        item["images"] = imgs
+        item["image"] = imgs[0]
+    item["id"] = pid
+    item["slug"] = slug
+    return item
+
+
+def build_products() -> list[dict]:
+    """Assemble the public product list from the products table and the image directory.
+
+    Image URLs are content-hashed; images with resized derivatives get
+    `variants[url] = {fmt: srcset}`.
+    """
+    with sqlite_conn() as con:
+        rows = product_rows(con)
+
+    images_map = image_index.catalog_map()
+    result = []
+    for row in rows:
+        item = product_item(row, images_map)
+        variants = {}
+        for url in item.get("images") or []:
+            if isinstance(url, str) and url.startswith(IMAGES_URL_PREFIX):
+                srcsets = variant_index.srcsets(url[len(IMAGES_URL_PREFIX):])
+                if srcsets:
+                    variants[hashed_url(url)] = srcsets
+        if variants:
+            item["variants"] = variants
+        # Content-hashed URLs can be cached forever; a replaced image gets a new one
+        if isinstance(item.get("images"), list):
+            item["images"] = [hashed_url(u) if isinstance(u, str) else u for u in item["images"]]
+        if isinstance(item.get("image"), str):
+            item["image"] = hashed_url(item["image"])
+        result.append(item)
+    return result
+
+
+def _render(content) -> bytes:
+    # Compact UTF-8 like the app's FastJSONResponse
+    return orjson.dumps(content)
+
+
+def etag_for(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class CatalogCache:
+    """Rendered /products payload, rebuilt only when its sources change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (signature, body, etag, products by id, id by slug, (body, etag) by id)
+        # swapped as a whole so readers never see a mix
+        self._state: tuple | None = None
+        # (etag, encoding) -> body compressed at max level, once per rebuild
+        self._encoded: dict[tuple[str, str], bytes] = {}
+
+    def _current_signature(self) -> tuple:
+        with sqlite_conn() as con:
+            row = con.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()
+        image_index.refresh()
+        variant_index.refresh()
+        return (str(db.DB_FILE), row[0] if row else None, image_index.version, variant_index.version)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._state = None
+
+    def _current(self) -> tuple:
+        signature = self._current_signature()
+        state = self._state
+        if state is not None and state[0] == signature:
+            return state
+        with self._lock:
+            state = self._state
+            if state is not None and state[0] == signature:
+                return state
+            products = build_products()
+            body = _render(products)
+            # Each product also gets its own body and validator, so a detail page
+            # only goes stale when that product (or its images) changes
+            rendered = {}
+            for p in products:
+                item_body = _render(p)
+                rendered[p["id"]] = (item_body, etag_for(item_body))
+            state = (
+                signature,
+                body,
+                etag_for(body),
+                {p["id"]: p for p in products},
+                {p["slug"]: p["id"] for p in products},
+                rendered,
+            )
+            self._state = state
+            self._encoded = {}
+            return state
+
+    def get(self) -> tuple[bytes, str]:
+        """Return (json_bytes, etag), rebuilding if products or images changed."""
+        state = self._current()
+        return state[1], state[2]
+
+    def products_by_id(self) -> dict[int, dict]:
+        """Public product dicts keyed by id, as of the current /products payload."""
+        return self._current()[3]
+
+    def get_product(self, product_id: int) -> tuple[bytes, str] | None:
+        """(json_bytes, etag) for one product, or None if there is no such id."""
+        return self._current()[5].get(product_id)
+
+    def get_product_by_slug(self, slug: str) -> tuple[bytes, str] | None:
+        state = self._current()
+        product_id = state[4].get(slug.lower())
+        return state[5].get(product_id) if product_id is not None else None
+
+    def get_encoded(self, encoding: str) -> tuple[bytes, str]:
+        """Like get(), with the body compressed as `encoding` ("br" or "gzip")."""
+        body, etag = self.get()
+        key = (etag, encoding)
+        data = self._encoded.get(key)
+        if data is None:
+            data = compress(body, encoding, quality=11 if encoding == "br" else 9)
+            with self._lock:
+                if self._state is not None and self._state[2] == etag:
+                    self._encoded[key] = data
+        return data, etag
+
+
+catalog = CatalogCache()
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Paths
@@ -13,6 +14,14 @@ DB_FILE = ROOT / "mock_payments.db"
 SECRET_KEY = "supersecretkey"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Verified token -> user cache (entries also expire with the token's exp)
+AUTH_CACHE_SIZE = 4096
+AUTH_CACHE_MAX_AGE_S = 300
+# bcrypt cost; stored hashes with another cost are rehashed on the next login
+BCRYPT_ROUNDS = 12
+# Processes running bcrypt, and hash/verify calls allowed in flight at once
+PASSWORD_HASH_WORKERS = max(1, min(4, os.cpu_count() or 1))
+PASSWORD_HASH_CONCURRENCY = 16
 
 # Users DB (SQLAlchemy)
 DATABASE_URL = "sqlite:///./users.db"
@@ -29,7 +38,67 @@ FRONT_TEE_IMAGES_DIR = (
 
 BACK_IMAGES_ROOT = ROOT / "public" / "images"
 BACK_TEE_IMAGES_DIR = BACK_IMAGES_ROOT / "tees" / "images"
+# Front-end -> back-end image sync (runs in the background at startup)
+IMAGE_SYNC_MANIFEST = BACK_IMAGES_ROOT / "tees" / ".sync-manifest.json"
+IMAGE_SYNC_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+# Response compression (dynamic responses; /products is cached precompressed)
+COMPRESSION_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Cache lifetime for content-hashed /images/_h/... URLs
+STATIC_IMMUTABLE_MAX_AGE_S = 365 * 24 * 3600
+
+# Admin image uploads: streamed to disk in chunks, capped per file and per request
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+UPLOAD_MAX_FILE_BYTES = 20 * 1024 * 1024
+UPLOAD_MAX_REQUEST_BYTES = 100 * 1024 * 1024
+UPLOAD_MAX_FILES = 50
+
+# Resized derivatives of the tee images (generated, served under /images/tees/variants/)
+IMAGE_VARIANTS_DIR = BACK_IMAGES_ROOT / "tees" / "variants"
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+IMAGE_VARIANT_FORMATS = {"avif": 50, "webp": 80}  # extension -> encoder quality
+IMAGE_VARIANT_WORKERS = max(1, min(2, os.cpu_count() or 1))
 
 # Geo
 NOVOSIB = (55.0084, 82.9357)
+# Fulfilment warehouses; product_ids None means the warehouse carries everything.
+# Orders ship from the nearest one stocking all their items (first listed is
+# the default when an order has no coordinates)
+WAREHOUSES = [
+    {"id": "nsk", "name": "Новосибирск", "lat": NOVOSIB[0], "lon": NOVOSIB[1], "product_ids": None},
+    {"id": "msk", "name": "Москва", "lat": 55.7558, "lon": 37.6173, "product_ids": None},
+    {"id": "ekb", "name": "Екатеринбург", "lat": 56.8389, "lon": 60.6057, "product_ids": None},
+]
+# Memoized ETA days/dates, keyed by whole-km distance and cart shape
+ETA_CACHE_SIZE = 10000
+ETA_CACHE_TTL_S = 600
+# Max destinations per POST /delivery-eta/batch
+DELIVERY_ETA_BATCH_MAX = 10000
+
+# SQLite connection tuning (orders/payments/reviews)
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_SYNCHRONOUS = "NORMAL"  # safe with WAL, avoids an fsync per commit
+SQLITE_STATEMENT_CACHE = 256
+# Threads running SQLite work for async handlers (one writer at a time anyway)
+SQLITE_EXECUTOR_WORKERS = 4
+
+# Mock payment processor latency, seconds (uniform between the bounds)
+PAYMENT_LATENCY_MIN_S = 10.0
+PAYMENT_LATENCY_MAX_S = 15.0
+# Longest a GET /payments/{id}?wait= long-poll may block
+PAYMENT_WAIT_MAX_S = 30.0
+
+# Reviews paging
+REVIEWS_PAGE_SIZE = 20
+REVIEWS_PAGE_MAX = 100
+# Max product ids per bulk review request
+REVIEWS_BULK_MAX_IDS = 500
 
+# Product search paging
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 100
+# Price facet bucket edges (roubles): [0, 3000), [3000, 3500), ..., [4500, inf)
+SEARCH_PRICE_BUCKETS = (3000, 3500, 4000, 4500)
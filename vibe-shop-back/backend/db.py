@@ -1,26 +1,34 @@
-from sqlalchemy import Column, Integer, String, create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
-from config import DATABASE_URL, DB_FILE
+from config import (
+    DB_FILE,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_STATEMENT_CACHE,
+    SQLITE_EXECUTOR_WORKERS,
+)
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from migrations import migrate
+import asyncio
 import sqlite3
+import threading
 
-# SQLAlchemy (users)
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine)
-Base = declarative_base()
+# SQLAlchemy (users) lives in users_db, loaded on first use; these names stay
+# importable from here
+_USERS_DB_NAMES = ("engine", "SessionLocal", "Base", "User")
 
 
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, unique=True, index=True)
-    password_hash = Column(String)
-    role = Column(String, default="user")
+def __getattr__(name: str):
+    if name in _USERS_DB_NAMES:
+        import users_db
 
-
-Base.metadata.create_all(bind=engine)
+        return getattr(users_db, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_db():
+    from users_db import SessionLocal
+
     db = SessionLocal()
     try:
         yield db
@@ -28,71 +36,131 @@ def get_db():
         db.close()
 
 
-def init_sqlite():
-    """Create/extend SQLite tables used for orders, payments, reviews."""
-    con = sqlite3.connect(DB_FILE)
-    cur = con.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id TEXT,
-            address TEXT,
-            items TEXT,
-            amount INTEGER,
-            created_at TEXT
-        )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id TEXT,
-            status TEXT,
-            amount INTEGER,
-            card_last4 TEXT,
-            card_brand TEXT,
-            created_at TEXT
-        )
-        """
+# SQLite (orders/payments/reviews): one long-lived connection per thread.
+# Worker threads are reused by the server, so each keeps its connection and
+# its prepared-statement cache across requests.
+_local = threading.local()
+_all_connections: list[sqlite3.Connection] = []
+_all_connections_lock = threading.Lock()
+_generation = 0
+# Database files already migrated by this process
+_migrated: set[str] = set()
+_migrate_lock = threading.RLock()
+
+
+def _open_sqlite() -> sqlite3.Connection:
+    con = sqlite3.connect(
+        DB_FILE,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=SQLITE_STATEMENT_CACHE,
     )
-    # Extend orders table with extra columns if missing
-    try:
-        cur.execute("ALTER TABLE orders ADD COLUMN geo_lat TEXT")
-    except Exception:
-        pass
-    try:
-        cur.execute("ALTER TABLE orders ADD COLUMN geo_lon TEXT")
-    except Exception:
-        pass
-    try:
-        cur.execute("ALTER TABLE orders ADD COLUMN username TEXT")
-    except Exception:
-        pass
-    # Reviews table
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    con.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+    with _all_connections_lock:
+        _all_connections.append(con)
+    # Schema upgrades happen on the first connection to a file, so nothing
+    # has to run at import time; init_sqlite just does it ahead of traffic
+    key = str(DB_FILE)
+    if key not in _migrated:
+        with _migrate_lock:
+            if key not in _migrated:
+                migrate(con)
+                _migrated.add(key)
+    return con
+
+
+def get_sqlite() -> sqlite3.Connection:
+    """Connection owned by the current thread, opened on first use."""
+    con = getattr(_local, "con", None)
+    key = (str(DB_FILE), _generation)
+    if con is None or getattr(_local, "key", None) != key:
+        con = _open_sqlite()
+        _local.con = con
+        _local.key = key
+        _local.depth = 0
+    return con
+
+
+@contextmanager
+def sqlite_conn():
+    """Use the thread's connection; commit on success, roll back on error.
+
+    Nested blocks share the outer transaction and only the outermost one
+    commits.
+    """
+    con = get_sqlite()
+    _local.depth += 1
     try:
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS reviews (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id TEXT,
-                rating INTEGER,
-                text TEXT,
-                author TEXT,
-                created_at TEXT
-            )
-            """
-        )
-    except Exception:
-        pass
-    con.commit()
-    con.close()
+        yield con
+    except BaseException:
+        if _local.depth == 1:
+            con.rollback()
+        raise
+    else:
+        if _local.depth == 1:
+            con.commit()
+    finally:
+        _local.depth -= 1
+
+
+# Async handlers never touch SQLite on the event loop: their DB work runs on
+# this small dedicated pool (each thread with its own pooled connection), so a
+# slow fsync only delays the queries queued behind it.
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SQLITE_EXECUTOR_WORKERS, thread_name_prefix="sqlite")
+        return _executor
+
+
+def _call_with_conn(fn, args, kwargs):
+    with sqlite_conn() as con:
+        return fn(con, *args, **kwargs)
+
+
+async def run_sqlite(fn, *args, **kwargs):
+    """Run fn(con, *args, **kwargs) as one transaction on the SQLite executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(_call_with_conn, fn, args, kwargs))
+
+
+def close_sqlite() -> None:
+    """Stop the SQLite executor and close every pooled connection (shutdown)."""
+    global _generation, _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+    with _all_connections_lock:
+        _generation += 1
+        cons = list(_all_connections)
+        _all_connections.clear()
+    for con in cons:
+        try:
+            con.close()
+        except Exception:
+            pass
+
+
+def init_sqlite():
+    """Bring the orders/payments/reviews SQLite schema up to date."""
+    key = str(DB_FILE)
+    with _migrate_lock:
+        migrate(get_sqlite())
+        _migrated.add(key)
 
 
 def ensure_admin_user():
     """Create default admin/admin user if no admin exists (dev convenience)."""
-    from security import get_password_hash  
+    from security import get_password_hash
+    from users_db import SessionLocal, User
 
     db = SessionLocal()
     try:
@@ -0,0 +1,237 @@
+"""Incremental copy of the front-end tee images into the back-end image directory.
+
+Only images of products in the catalog are synced (`<pid>_<n>.ext` belongs to
+product pid): the front-end set holds far more groups than the shop sells, and
+every group in the directory would end up in the image index. Copies an
+earlier pass made for groups that are no longer wanted are removed again.
+
+A manifest records, for every file the sync wrote, the source's size, mtime
+and sha256. A run stats the source directory and copies only files that are
+new or whose content changed; an unchanged stat skips the file without reading
+it. Targets the sync did not write, or that changed since it wrote them (admin
+uploads and replacements), are never overwritten; they are recorded as "kept"
+with both stats, so they are not hashed again until one of the two changes.
+Copies run on a thread pool and use a reflink or hardlink where the filesystem
+allows, falling back to a plain copy. A .gitignore written next to the manifest
+lists exactly the files the sync wrote.
+"""
+import asyncio
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from config import BACK_TEE_IMAGES_DIR, FRONT_TEE_IMAGES_DIR, IMAGE_SYNC_MANIFEST, IMAGE_SYNC_WORKERS
+from db import sqlite_conn
+from variants import variant_index
+
+_FICLONE = 0x40049409  # linux/fs.h
+_HASH_CHUNK = 1024 * 1024
+_IMAGE_RE = re.compile(r"\.(jpe?g|png|webp)$", flags=re.I)
+_GLOB_RE = re.compile(r"([*?\[\\])")
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    with src.open("rb") as fin, dst.open("wb") as fout:
+        fcntl.ioctl(fout.fileno(), _FICLONE, fin.fileno())
+    shutil.copystat(src, dst)
+
+
+def clone_file(src: Path, dst: Path) -> str:
+    """Place a copy of src at dst atomically; returns "reflink", "hardlink" or "copy"."""
+    tmp = dst.with_name(f".{dst.name}.sync-tmp")
+    for method, fn in (("reflink", _reflink), ("hardlink", os.link), ("copy", shutil.copy2)):
+        try:
+            tmp.unlink(missing_ok=True)
+            fn(src, tmp)
+        except OSError as e:
+            if method == "copy" or e.errno not in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EMLINK):
+                tmp.unlink(missing_ok=True)
+                raise
+            continue
+        os.replace(tmp, dst)
+        return method
+    raise AssertionError("unreachable")
+
+
+def _stat_sig(path: Path) -> tuple[int, int] | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+def catalog_groups() -> set[str]:
+    """Image groups (product ids) of the products in the catalog."""
+    with sqlite_conn() as con:
+        return {str(pid) for (pid,) in con.execute("SELECT id FROM products")}
+
+
+class ImageSync:
+    def __init__(self, src_dir: Path, dst_dir: Path, manifest_path: Path, workers: int, groups=None):
+        self.src_dir = src_dir
+        self.dst_dir = dst_dir
+        self.manifest_path = manifest_path
+        self.workers = workers
+        self.groups = groups  # () -> set of product ids to sync; None syncs every image
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+        self.last_run: dict | None = None
+
+    def _load_manifest(self) -> dict:
+        try:
+            data = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest: dict) -> None:
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        tmp.write_text(json.dumps(manifest, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, self.manifest_path)
+
+    def _save_ignore(self, manifest: dict) -> None:
+        # Only files the sync wrote; kept (admin) files and curated images stay visible to git
+        path = self.manifest_path.with_name(".gitignore")
+        lines = ["# Written by image_sync: the front-end images it copied in", "/.gitignore", "/" + self.manifest_path.name]
+        for name, entry in sorted(manifest.items()):
+            if not entry.get("kept"):
+                rel = Path(os.path.relpath(self.dst_dir / name, path.parent)).as_posix()
+                lines.append("/" + _GLOB_RE.sub(r"\\\1", rel))
+        text = "\n".join(lines) + "\n"
+        try:
+            if path.read_text(encoding="utf-8") == text:
+                return
+        except OSError:
+            pass
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, path)
+
+    def _remove_unwanted(self, name: str, entry: dict) -> bool:
+        """Delete a file an earlier pass wrote for a group that is no longer synced."""
+        dst = self.dst_dir / name
+        if entry.get("kept") or _stat_sig(dst) != (entry.get("size"), entry.get("mtime_ns")):
+            return False  # not ours, or changed since: leave it
+        dst.unlink(missing_ok=True)
+        variant_index.remove(name)
+        return True
+
+    def _plan(self, name: str, entry: dict | None) -> tuple[str, dict | None]:
+        """("skip" | "copy" | "keep", manifest entry to record) for one source file."""
+        src, dst = self.src_dir / name, self.dst_dir / name
+        sig = _stat_sig(src)
+        if sig is None:
+            return "skip", entry
+        dst_sig = _stat_sig(dst)
+        if entry is not None and entry.get("kept"):
+            if dst_sig == (entry["size"], entry["mtime_ns"]) and entry["src"] == list(sig):
+                return "keep", entry  # same two files as last time: still not ours
+            entry = None  # either side changed: judge the pair afresh
+        if entry is not None and dst_sig is None:
+            return "keep", entry  # we wrote it and it was deleted since: leave it deleted
+        written = entry is not None and dst_sig == (entry["size"], entry["mtime_ns"])
+        if written and entry.get("src") == list(sig):
+            return "skip", entry
+        digest = file_sha256(src)
+        if dst_sig is not None and not written:
+            # Not ours, or changed since we wrote it: adopt only if identical
+            if dst_sig[0] == sig[0] and file_sha256(dst) == digest:
+                return "skip", {"size": dst_sig[0], "mtime_ns": dst_sig[1], "sha256": digest, "src": list(sig)}
+            return "keep", {"size": dst_sig[0], "mtime_ns": dst_sig[1], "src": list(sig), "kept": True}
+        if written and entry["sha256"] == digest:
+            return "skip", {**entry, "src": list(sig)}
+        return "copy", {"sha256": digest}
+
+    def _copy(self, name: str, entry: dict) -> tuple[str, dict, str]:
+        src = self.src_dir / name
+        method = clone_file(src, self.dst_dir / name)
+        size, mtime_ns = _stat_sig(self.dst_dir / name)
+        return name, {**entry, "size": size, "mtime_ns": mtime_ns, "src": list(_stat_sig(src))}, method
+
+    def run(self) -> dict:
+        """One sync pass; returns counts for the status endpoint."""
+        with self._lock:
+            started = time.perf_counter()
+            result = {"copied": 0, "unchanged": 0, "kept": 0, "removed": 0, "methods": {}}
+            wanted = self.groups() if self.groups is not None else None
+
+            def in_scope(name: str) -> bool:
+                return wanted is None or name.split("_", 1)[0] in wanted
+
+            try:
+                names = sorted(
+                    p.name for p in self.src_dir.iterdir() if p.is_file() and _IMAGE_RE.search(p.name) and in_scope(p.name)
+                )
+            except OSError:
+                names = []
+            self.dst_dir.mkdir(parents=True, exist_ok=True)
+            old = self._load_manifest()
+            for name, entry in old.items():
+                if not in_scope(name) and self._remove_unwanted(name, entry):
+                    result["removed"] += 1
+            manifest, to_copy = {}, {}
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for name, (action, entry) in zip(names, pool.map(lambda n: self._plan(n, old.get(n)), names)):
+                    if action == "copy":
+                        to_copy[name] = entry
+                        continue
+                    result["kept" if action == "keep" else "unchanged"] += 1
+                    if entry is not None:
+                        manifest[name] = entry
+                for name, entry, method in pool.map(lambda item: self._copy(*item), to_copy.items()):
+                    manifest[name] = entry
+                    result["copied"] += 1
+                    result["methods"][method] = result["methods"].get(method, 0) + 1
+                    if name in old and variant_index.srcsets(name):
+                        # Content changed under existing derivatives: rebuild them
+                        variant_index.remove(name)
+                        variant_index.schedule([name])
+            self._save_manifest(manifest)
+            self._save_ignore(manifest)
+            result["took_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            self.last_run = result
+            return result
+
+    async def start(self) -> None:
+        """Run a sync pass in the background; the app serves whatever is already there meanwhile."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(asyncio.to_thread(self.run))
+
+    async def wait(self) -> dict | None:
+        """Result of the running background pass (or of the last one)."""
+        if self._task is None:
+            return self.last_run
+        return await asyncio.shield(self._task)
+
+    async def stop(self) -> None:
+        # A pass cannot be interrupted mid-copy; let it finish so the manifest is written
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        return {"running": self._task is not None and not self._task.done(), "last_run": self.last_run}
+
+
+image_sync = ImageSync(FRONT_TEE_IMAGES_DIR, BACK_TEE_IMAGES_DIR, IMAGE_SYNC_MANIFEST, IMAGE_SYNC_WORKERS, catalog_groups)
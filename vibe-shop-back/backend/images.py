@@ -0,0 +1,214 @@
+import bisect
+import hashlib
+import re
+import threading
+from pathlib import Path
+
+from config import BACK_IMAGES_ROOT, BACK_TEE_IMAGES_DIR, FRONT_TEE_IMAGES_DIR
+
+IMAGES_URL_PREFIX = "/images/tees/images/"
+# /images/_h/<content hash>/<path>: same file, but the URL changes with its bytes
+HASHED_URL_PREFIX = "/images/_h/"
+
+_IMAGE_RE = re.compile(r"\.(jpe?g|png|webp)$", flags=re.I)
+_SUFFIX_RE = re.compile(r"_(\d+)")
+_NUMBERED_RE = re.compile(r"_(\d+)\.")
+_CHART_INDEX_RE = re.compile(r"_(6)\.")
+_CHART_WORD_RE = re.compile(r"(chart|size|sizing|dimension|guide|table|таблиц|размер)", flags=re.I)
+
+
+def _group_of(name: str) -> str | None:
+    """Product id for a `<pid>_<n>.ext` image file name, or None if not a product image."""
+    if not _IMAGE_RE.search(name):
+        return None
+    parts = name.split("_", 1)
+    if len(parts) < 2:
+        return None
+    return parts[0]
+
+
+def _sort_key(n: str) -> tuple[int, str]:
+    m = _SUFFIX_RE.search(n)
+    return (int(m.group(1)) if m else 0, n)
+
+
+def _is_chart(n: str) -> bool:
+    # Heuristic: consider index _6 or keyworded filenames as size-chart
+    if _CHART_INDEX_RE.search(n):
+        return True
+    return _CHART_WORD_RE.search(n) is not None
+
+
+def _pick_catalog_images(sorted_names: list[str]) -> list[str] | None:
+    chart = next((n for n in sorted_names if _is_chart(n)), None)
+    non_chart = [n for n in sorted_names if n != chart]
+    take = 4 if chart else 5
+    picked = [n for n in non_chart if _NUMBERED_RE.search(n)][:take]
+    if chart:
+        picked.append(chart)
+    return picked if len(picked) == 5 else None
+
+
+class ImageIndex:
+    """pid -> ordered image files of the tee image directory.
+
+    Admin handlers update the index in place through add()/remove(), so each
+    edit costs O(files of that pid). Changes made outside the app are picked
+    up by comparing the directory mtime and rescanning only when it moved.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._dir_sig: tuple | None = None
+        self._groups: dict[str, list[str]] = {}
+        self._picked: dict[str, list[str]] = {}
+        self.version = 0
+
+    @property
+    def directory(self) -> Path:
+        return BACK_TEE_IMAGES_DIR if BACK_TEE_IMAGES_DIR.exists() else FRONT_TEE_IMAGES_DIR
+
+    def _stat_dir(self, directory: Path) -> tuple:
+        try:
+            return (str(directory), directory.stat().st_mtime_ns)
+        except OSError:
+            return (str(directory), None)
+
+    def _reindex(self, pid: str) -> None:
+        names = self._groups.get(pid)
+        if not names:
+            self._groups.pop(pid, None)
+            self._picked.pop(pid, None)
+            return
+        picked = _pick_catalog_images(names)
+        if picked:
+            self._picked[pid] = picked
+        else:
+            self._picked.pop(pid, None)
+
+    def _rescan(self, directory: Path) -> None:
+        groups: dict[str, list[str]] = {}
+        try:
+            if directory.exists():
+                for p in directory.iterdir():
+                    pid = _group_of(p.name)
+                    if pid is not None and p.is_file():
+                        groups.setdefault(pid, []).append(p.name)
+        except OSError:
+            groups = {}
+        self._groups = {pid: sorted(names, key=_sort_key) for pid, names in groups.items()}
+        self._picked = {}
+        for pid in self._groups:
+            self._reindex(pid)
+        self.version += 1
+
+    def refresh(self) -> None:
+        """Rescan the directory if its mtime changed since the last look."""
+        directory = self.directory
+        sig = self._stat_dir(directory)
+        if sig == self._dir_sig:
+            return
+        with self._lock:
+            if sig == self._dir_sig:
+                return
+            self._rescan(directory)
+            self._dir_sig = sig
+
+    def _touched(self) -> None:
+        # Our own writes move the directory mtime too; record it so they don't force a rescan
+        self._dir_sig = self._stat_dir(self.directory)
+        self.version += 1
+
+    def add(self, name: str) -> None:
+        pid = _group_of(name)
+        if pid is None:
+            return
+        with self._lock:
+            self.refresh()
+            names = self._groups.setdefault(pid, [])
+            if name not in names:
+                bisect.insort(names, name, key=_sort_key)
+            self._reindex(pid)
+            self._touched()
+
+    def remove(self, name: str) -> None:
+        pid = _group_of(name)
+        if pid is None:
+            return
+        with self._lock:
+            self.refresh()
+            names = self._groups.get(pid)
+            if names and name in names:
+                names.remove(name)
+            self._reindex(pid)
+            self._touched()
+
+    def files(self, pid) -> list[str]:
+        self.refresh()
+        with self._lock:
+            return list(self._groups.get(str(pid), ()))
+
+    def next_index(self, pid) -> int:
+        """First free `<pid>_<n>` suffix after the existing ones."""
+        counter = 1
+        for name in self.files(pid):
+            m = _SUFFIX_RE.search(name)
+            if m:
+                counter = max(counter, int(m.group(1)) + 1)
+        return counter
+
+    def urls_map(self) -> dict[str, list[str]]:
+        """All images per pid, ordered by suffix."""
+        self.refresh()
+        with self._lock:
+            return {pid: [IMAGES_URL_PREFIX + n for n in names] for pid, names in self._groups.items()}
+
+    def catalog_map(self) -> dict[str, list[str]]:
+        """The five storefront images (size chart last) per pid that has a full set."""
+        self.refresh()
+        with self._lock:
+            return {pid: [IMAGES_URL_PREFIX + n for n in names] for pid, names in self._picked.items()}
+
+
+image_index = ImageIndex()
+
+
+class ContentHashes:
+    """Short sha256 of files, recomputed only when their (mtime, size) change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache: dict[str, tuple[int, int, str]] = {}
+
+    def get(self, path: Path) -> str | None:
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        key = str(path)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        h = hashlib.sha256()
+        try:
+            with path.open("rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    h.update(chunk)
+        except OSError:
+            return None
+        digest = h.hexdigest()[:16]
+        with self._lock:
+            self._cache[key] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+
+content_hashes = ContentHashes()
+
+
+def hashed_url(url: str) -> str:
+    """Content-addressed form of an /images/... URL (unchanged if the file is missing)."""
+    if not url.startswith("/images/") or url.startswith(HASHED_URL_PREFIX):
+        return url
+    rel = url[len("/images/"):]
+    digest = content_hashes.get(BACK_IMAGES_ROOT / rel)
+    return f"{HASHED_URL_PREFIX}{digest}/{rel}" if digest else url
@@ -1,19 +1,58 @@
+from startup import startup_report  # first import: starts the startup clock
+
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from utils import ensure_images_synced, mount_images
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
-from db import init_sqlite, ensure_admin_user
+startup_report.mark("import fastapi")
+
+from responses import CompressionMiddleware, FastJSONResponse
+from utils import mount_images, precompress_svgs
+from db import init_sqlite, ensure_admin_user, close_sqlite
+from image_sync import image_sync
+from passwords import close_password_pool
+from payments import payment_processor
+from variants import variant_index
 from routes import products as products_router
 from routes import checkout as checkout_router
 from routes import reviews as reviews_router
 from routes import admin as admin_router
 from routes import auth as auth_router
 
+startup_report.mark("import app modules")
+
+
+# Importing this module only wires the app up; all I/O happens here, so test
+# collection and worker boot stay cheap. SQLAlchemy, jose, passlib and numpy
+# load on first use.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with startup_report.phase("sqlite migrations"):
+        await run_in_threadpool(init_sqlite)
+    with startup_report.phase("svg precompression"):
+        await run_in_threadpool(precompress_svgs)
+    with startup_report.phase("payment processor"):
+        await payment_processor.start()
+    await image_sync.start()
+    startup_report.in_background("image sync", image_sync.wait())
+    # May compute a bcrypt hash; nothing needs it before the first admin login
+    startup_report.in_background("default admin user", run_in_threadpool(ensure_admin_user))
+    startup_report.ready()
+    try:
+        yield
+    finally:
+        await payment_processor.stop()
+        await image_sync.stop()
+        close_sqlite()
+        close_password_pool()
+        variant_index.close()
 
-app = FastAPI()
+
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
 
 # Static/images
-ensure_images_synced()
 mount_images(app)
 
 # CORS
@@ -26,11 +65,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
-
-# DB initialization
-init_sqlite()
-ensure_admin_user()
+# Added last so it wraps CORS too and sees every response body
+app.add_middleware(CompressionMiddleware)
 
 # Routers
 app.include_router(products_router.router)
@@ -39,8 +77,9 @@ app.include_router(reviews_router.router)
 app.include_router(admin_router.router)
 app.include_router(auth_router.router)
 
+startup_report.mark("app setup")
+
 
 @app.get("/")
 async def root():
     return {"status": "ok"}
-
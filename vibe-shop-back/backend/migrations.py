@@ -0,0 +1,324 @@
+"""Versioned schema migrations for mock_payments.db.
+
+Each step runs in its own transaction and records its version in
+`schema_version`. Steps must be safe on databases created before this table
+existed, so the first one only creates/extends what is missing.
+"""
+import datetime
+import json
+import sqlite3
+
+from config import DATA_FILE
+from utils import parse_items, slugify
+
+
+def _columns(con: sqlite3.Connection, table: str) -> set[str]:
+    return {row[1] for row in con.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column_if_missing(con: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    if column not in _columns(con, table):
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _m1_base_schema(con: sqlite3.Connection) -> None:
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id TEXT,
+            address TEXT,
+            items TEXT,
+            amount INTEGER,
+            created_at TEXT
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id TEXT,
+            status TEXT,
+            amount INTEGER,
+            card_last4 TEXT,
+            card_brand TEXT,
+            created_at TEXT
+        )
+        """
+    )
+    _add_column_if_missing(con, "orders", "geo_lat", "TEXT")
+    _add_column_if_missing(con, "orders", "geo_lon", "TEXT")
+    _add_column_if_missing(con, "orders", "username", "TEXT")
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id TEXT,
+            rating INTEGER,
+            text TEXT,
+            author TEXT,
+            created_at TEXT
+        )
+        """
+    )
+
+
+def _m2_hot_query_indexes(con: sqlite3.Connection) -> None:
+    con.execute("CREATE INDEX IF NOT EXISTS idx_orders_order_id ON orders(order_id)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_orders_username_id ON orders(username, id)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_payments_order_id_id ON payments(order_id, id)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_reviews_product_id_id ON reviews(product_id, id)")
+
+
+def _order_item_rows(order_id: str, items_raw: str | None) -> list[tuple]:
+    rows = []
+    for it in parse_items(items_raw):
+        try:
+            rows.append((order_id, int(it.get("id")), str(it.get("name")), int(it.get("price")), int(it.get("qty", 1))))
+        except Exception:
+            continue
+    return rows
+
+
+def _m3_order_items(con: sqlite3.Connection) -> None:
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            name TEXT,
+            price INTEGER NOT NULL,
+            qty INTEGER NOT NULL
+        )
+        """
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items(product_id, qty, price)")
+
+    # Backfill from the JSON items column in id batches to keep memory flat
+    last_id = 0
+    while True:
+        batch = con.execute(
+            "SELECT id, order_id, items FROM orders WHERE id > ? ORDER BY id LIMIT 1000", (last_id,)
+        ).fetchall()
+        if not batch:
+            break
+        rows = []
+        for _, order_id, items_raw in batch:
+            rows.extend(_order_item_rows(order_id, items_raw))
+        con.executemany(
+            "INSERT INTO order_items (order_id, product_id, name, price, qty) VALUES (?, ?, ?, ?, ?)", rows
+        )
+        last_id = batch[-1][0]
+
+
+def _m4_review_stats(con: sqlite3.Connection) -> None:
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS review_stats (
+            product_id TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            sum INTEGER NOT NULL DEFAULT 0,
+            r1 INTEGER NOT NULL DEFAULT 0,
+            r2 INTEGER NOT NULL DEFAULT 0,
+            r3 INTEGER NOT NULL DEFAULT 0,
+            r4 INTEGER NOT NULL DEFAULT 0,
+            r5 INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """
+    )
+    con.execute("DELETE FROM review_stats")
+    con.execute(
+        """
+        INSERT INTO review_stats (product_id, count, sum, r1, r2, r3, r4, r5)
+        SELECT product_id, COUNT(*), SUM(rating),
+               SUM(rating = 1), SUM(rating = 2), SUM(rating = 3), SUM(rating = 4), SUM(rating = 5)
+        FROM reviews
+        WHERE product_id IS NOT NULL
+        GROUP BY product_id
+        """
+    )
+
+
+def _m5_reviews_rating_index(con: sqlite3.Connection) -> None:
+    # (product_id, id, rating) keeps the newest-first walk and lets the rating
+    # filter be checked in the index; it supersedes the (product_id, id) one
+    con.execute("CREATE INDEX IF NOT EXISTS idx_reviews_product_id_id_rating ON reviews(product_id, id, rating)")
+    con.execute("DROP INDEX IF EXISTS idx_reviews_product_id_id")
+
+
+def _m6_async_payments(con: sqlite3.Connection) -> None:
+    _add_column_if_missing(con, "payments", "message", "TEXT")
+    _add_column_if_missing(con, "payments", "transaction_id", "TEXT")
+    _add_column_if_missing(con, "payments", "latency_ms", "INTEGER")
+    _add_column_if_missing(con, "payments", "processed_at", "TEXT")
+    _add_column_if_missing(con, "orders", "eta_days", "INTEGER")
+    _add_column_if_missing(con, "orders", "eta_date", "TEXT")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_payments_pending ON payments(id) WHERE status = 'pending'")
+
+
+def _m7_order_warehouse(con: sqlite3.Connection) -> None:
+    _add_column_if_missing(con, "orders", "warehouse_id", "TEXT")
+
+
+_PRODUCT_COLUMNS = ("id", "name", "price", "description")
+
+
+def _product_seed_rows() -> list[tuple]:
+    try:
+        data = json.loads(DATA_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        data = []
+    # Ids come from products.json alone (they are the image group numbers the
+    # curated images were shipped under), so every machine seeds the same ids
+    # whatever the image directory holds; a product without one gets the next rowid
+    rows, used_ids, used_slugs = [], set(), set()
+    for i, item in enumerate(data if isinstance(data, list) else []):
+        if not isinstance(item, dict):
+            continue
+        pid = item.get("id")
+        if not isinstance(pid, int) or pid in used_ids:
+            pid = None
+        used_ids.add(pid)
+        base = slugify(str(item.get("name") or "")) or "product"
+        slug, n = base, 2
+        while slug in used_slugs:
+            slug, n = f"{base}-{n}", n + 1
+        used_slugs.add(slug)
+        extra = {k: v for k, v in item.items() if k not in _PRODUCT_COLUMNS}
+        rows.append((pid, i, slug, item.get("name"), item.get("price"), item.get("description"), json.dumps(extra, ensure_ascii=False)))
+    return rows
+
+
+def _m8_products(con: sqlite3.Connection) -> None:
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY,
+            position INTEGER NOT NULL,
+            slug TEXT NOT NULL UNIQUE,
+            name TEXT,
+            price INTEGER,
+            description TEXT,
+            extra TEXT NOT NULL DEFAULT '{}'
+        )
+        """
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS idx_products_position ON products(position, id)")
+    # Bumped by triggers on any product change, so every worker's catalog cache
+    # notices edits made elsewhere with one single-row read
+    con.execute("CREATE TABLE IF NOT EXISTS catalog_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)")
+    con.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        con.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_products_{event.lower()} AFTER {event} ON products
+            BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END
+            """
+        )
+    if con.execute("SELECT COUNT(*) FROM products").fetchone()[0] == 0:
+        con.executemany(
+            "INSERT INTO products (id, position, slug, name, price, description, extra) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            _product_seed_rows(),
+        )
+
+
+def _m9_products_fts(con: sqlite3.Connection) -> None:
+    # External-content index over products: triggers keep it in step with row
+    # edits, so admin updates reindex just the rows they touch. unicode61 folds
+    # case for Cyrillic and Latin alike; porter stems the English words.
+    con.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description,
+            content='products', content_rowid='id',
+            tokenize='porter unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+        """
+    )
+    con.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        END
+        """
+    )
+    con.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_update AFTER UPDATE OF id, name, description ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+        """
+    )
+    con.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+
+# (version, description, step) in application order; never renumber or edit shipped steps
+MIGRATIONS = [
+    (1, "base orders/payments/reviews schema", _m1_base_schema),
+    (2, "indexes for order, payment and review lookups", _m2_hot_query_indexes),
+    (3, "normalized order_items with backfill", _m3_order_items),
+    (4, "per-product review_stats with backfill", _m4_review_stats),
+    (5, "reviews index covering the rating filter", _m5_reviews_rating_index),
+    (6, "payment job results and order ETA columns", _m6_async_payments),
+    (7, "shipping warehouse per order", _m7_order_warehouse),
+    (8, "products table seeded from products.json", _m8_products),
+    (9, "full-text index over product name and description", _m9_products_fts),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(con: sqlite3.Connection) -> int:
+    try:
+        row = con.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def migrate(con: sqlite3.Connection) -> int:
+    """Apply pending migrations and return the resulting schema version."""
+    if current_version(con) >= LATEST_VERSION:
+        return LATEST_VERSION
+
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )
+        """
+    )
+    con.commit()
+
+    for version, description, step in MIGRATIONS:
+        # IMMEDIATE takes the write lock up front, so workers starting together
+        # apply each step exactly once
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(con) >= version:
+                con.rollback()
+                continue
+            step(con)
+            con.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.datetime.utcnow().isoformat()),
+            )
+            con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+    return current_version(con)
@@ -0,0 +1,98 @@
+"""bcrypt hashing off the request threads.
+
+A bcrypt call is a few hundred ms of pure CPU that holds the GIL, so async
+handlers hand it to a small process pool instead. At most
+PASSWORD_HASH_CONCURRENCY calls are queued or running at once; callers beyond
+that wait on the event loop, where a disconnecting client simply drops out.
+This module stays import-light because pool workers import it too; passlib
+itself loads on the first hash.
+"""
+import asyncio
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from config import BCRYPT_ROUNDS, PASSWORD_HASH_CONCURRENCY, PASSWORD_HASH_WORKERS
+
+
+@functools.cache
+def _context(rounds: int = BCRYPT_ROUNDS):
+    from passlib.context import CryptContext
+
+    # min == max == default: any stored hash with a different cost needs an update
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+def __getattr__(name: str):
+    if name == "pwd_context":
+        return _context()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def hash_password(password: str) -> str:
+    return _context().hash(password)
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    return _context().verify(password, hashed)
+
+
+def verify_and_update(password: str, hashed: str, rounds: int = BCRYPT_ROUNDS) -> tuple[bool, str | None]:
+    """(matches, new_hash); new_hash is set when the stored cost is not `rounds`."""
+    return _context(rounds).verify_and_update(password, hashed)
+
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_limit: tuple[asyncio.AbstractEventLoop, asyncio.Semaphore] | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver: never fork the multi-threaded server; workers import this module fresh
+            _pool = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("forkserver")
+            )
+        return _pool
+
+
+def _limiter() -> asyncio.Semaphore:
+    # One semaphore per event loop (the test client runs a loop per client)
+    global _limit
+    loop = asyncio.get_running_loop()
+    if _limit is None or _limit[0] is not loop:
+        _limit = (loop, asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY))
+    return _limit[1]
+
+
+async def _run(fn, *args):
+    async with _limiter():
+        return await asyncio.get_running_loop().run_in_executor(_get_pool(), fn, *args)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run(hash_password, password)
+
+
+async def verify_and_update_async(
+    password: str, hashed: str, rounds: int = BCRYPT_ROUNDS
+) -> tuple[bool, str | None]:
+    return await _run(verify_and_update, password, hashed, rounds)
+
+
+def close_password_pool() -> None:
+    """Stop the hashing processes (shutdown)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
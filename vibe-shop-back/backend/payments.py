@@ -0,0 +1,163 @@
+"""Mock payment processor.
+
+/pay-mock only records a `pending` payment and schedules it here; the
+processor settles it after a simulated latency and writes the outcome
+(status, latency, order ETA and shipping warehouse) back to SQLite. Jobs sit in a heap ordered by
+due time and a single dispatcher task on the event loop settles them, so any
+number of payments can be in flight without holding a request or a worker.
+"""
+import asyncio
+import datetime
+import heapq
+import itertools
+import random
+from types import SimpleNamespace
+
+from config import PAYMENT_LATENCY_MIN_S, PAYMENT_LATENCY_MAX_S
+from db import run_sqlite
+from warehouses import eta_cache
+
+DECLINE_CARD = "4000000000009995"
+DECLINE_BRAND = "visa_decline"
+
+MESSAGES = {
+    "pending": "Платёж обрабатывается",
+    "succeeded": "Платёж успешно проведён",
+    "declined": "Платёж отклонён",
+}
+
+
+def sample_latency() -> float:
+    """Simulated processor latency in seconds (uniform between the configured bounds)."""
+    return random.uniform(PAYMENT_LATENCY_MIN_S, PAYMENT_LATENCY_MAX_S)
+
+
+def _order_eta(con, order_id: str) -> tuple[int, str, int, str]:
+    row = con.execute("SELECT geo_lat, geo_lon FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+    items = [
+        SimpleNamespace(id=pid, qty=qty)
+        for pid, qty in con.execute("SELECT product_id, qty FROM order_items WHERE order_id = ?", (order_id,))
+    ]
+    geo_lat = None; geo_lon = None
+    try:
+        geo_lat = float(row[0]) if row and row[0] is not None else None
+        geo_lon = float(row[1]) if row and row[1] is not None else None
+    except Exception:
+        pass
+    return eta_cache.route_eta(items, geo_lat, geo_lon)
+
+
+def settle(con, payment_id: int, latency: float) -> None:
+    """Decide the outcome of a pending payment and persist it with the order ETA."""
+    processed_at = datetime.datetime.utcnow().isoformat()
+    row = con.execute(
+        "SELECT order_id, card_brand FROM payments WHERE id = ? AND status = 'pending'", (payment_id,)
+    ).fetchone()
+    if not row:
+        return
+    order_id, brand = row
+    if brand == DECLINE_BRAND:
+        status, txn = "declined", None
+    else:
+        status, txn = "succeeded", f"TXN-{random.randint(1000000,9999999)}"
+    # Guarded so a duplicate or late settle (e.g. another worker rescheduling
+    # the same pending payment at boot) never overwrites a final status
+    cur = con.execute(
+        "UPDATE payments SET status = ?, message = ?, transaction_id = ?, latency_ms = ?, processed_at = ?"
+        " WHERE id = ? AND status = 'pending'",
+        (status, MESSAGES[status], txn, int(latency * 1000), processed_at, payment_id),
+    )
+    if cur.rowcount and status == "succeeded":
+        days, eta_date, _, warehouse_id = _order_eta(con, order_id)
+        con.execute(
+            "UPDATE orders SET eta_days = ?, eta_date = ?, warehouse_id = ? WHERE order_id = ?",
+            (days, eta_date, warehouse_id, order_id),
+        )
+
+
+def _pending_ids(con) -> list[int]:
+    return [r[0] for r in con.execute("SELECT id FROM payments WHERE status = 'pending'")]
+
+
+class PaymentProcessor:
+    def __init__(self):
+        self._heap: list[tuple[float, int, int, float]] = []  # (due, seq, payment_id, latency)
+        self._seq = itertools.count()
+        self._waiters: dict[int, list] = {}  # payment_id -> [event, long-polls waiting on it]
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._settling: set[asyncio.Task] = set()
+
+    def _ensure_running(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    async def start(self) -> None:
+        """Start the dispatcher and reschedule payments left pending by a previous run."""
+        self._ensure_running()
+        for payment_id in await run_sqlite(_pending_ids):
+            self.submit(payment_id)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def submit(self, payment_id: int, latency: float | None = None) -> None:
+        self._ensure_running()
+        latency = sample_latency() if latency is None else latency
+        due = asyncio.get_running_loop().time() + latency
+        heapq.heappush(self._heap, (due, next(self._seq), payment_id, latency))
+        self._wakeup.set()
+
+    def waiter(self, payment_id: int) -> asyncio.Event:
+        """Event set when this payment settles; register it before reading the status.
+
+        Every waiter() call must be paired with a release_waiter() call.
+        """
+        entry = self._waiters.setdefault(payment_id, [asyncio.Event(), 0])
+        entry[1] += 1
+        return entry[0]
+
+    def release_waiter(self, payment_id: int) -> None:
+        # Dropped once the last long-poll sharing the event is done with it
+        entry = self._waiters.get(payment_id)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._waiters[payment_id]
+
+    async def _settle(self, payment_id: int, latency: float) -> None:
+        try:
+            await run_sqlite(settle, payment_id, latency)
+        except Exception:
+            # stays pending; start() reschedules it on the next boot
+            pass
+        entry = self._waiters.pop(payment_id, None)
+        if entry is not None:
+            entry[0].set()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, payment_id, latency = heapq.heappop(self._heap)
+                task = loop.create_task(self._settle(payment_id, latency))
+                self._settling.add(task)
+                task.add_done_callback(self._settling.discard)
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+payment_processor = PaymentProcessor()
@@ -0,0 +1,176 @@
+"""App-wide JSON response class and response compression."""
+import zlib
+
+import brotli
+import orjson
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+from config import BROTLI_QUALITY, COMPRESSION_MIN_BYTES, GZIP_LEVEL
+
+_COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/javascript", "image/svg+xml", "text/")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (compact UTF-8, like the stdlib setup it replaces)."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str | None:
+    """"br" or "gzip" if the client accepts it (brotli preferred), else None."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, quality: int | None = None):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=BROTLI_QUALITY if quality is None else quality)
+        else:
+            self._c = zlib.compressobj(GZIP_LEVEL if quality is None else quality, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data) if self.encoding == "br" else self._c.compress(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush() if self.encoding == "br" else self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._c.finish() if self.encoding == "br" else self._c.flush()
+
+
+def compress(data: bytes, encoding: str, quality: int | None = None) -> bytes:
+    c = _Compressor(encoding, quality)
+    return c.compress(data) + c.finish()
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """Distinct validator for an encoded representation: "abc" -> "abc-br"."""
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+
+def _unwrap_if_none_match(scope, encoding: str) -> tuple[dict, set[str]]:
+    """Add the plain form of any `-<encoding>` tag in If-None-Match; returns (scope, plain tags added)."""
+    if_none_match = Headers(scope=scope).get("if-none-match")
+    if not if_none_match:
+        return scope, set()
+    suffix = f'-{encoding}"'
+    plain = {
+        tag[: -len(suffix)] + '"'
+        for tag in (t.strip().removeprefix("W/") for t in if_none_match.split(","))
+        if tag.endswith(suffix)
+    }
+    if not plain:
+        return scope, set()
+    value = ", ".join([if_none_match, *sorted(plain)]).encode("latin-1")
+    headers = [(k, v) for k, v in scope["headers"] if k != b"if-none-match"]
+    return {**scope, "headers": [*headers, (b"if-none-match", value)]}, plain
+
+
+class _CompressingSend:
+    def __init__(self, send, encoding: str, minimum_size: int, unwrapped_etags: set[str] = frozenset()):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.unwrapped_etags = unwrapped_etags
+        self.start: dict | None = None
+        self.compressor: _Compressor | None = None
+        self.passthrough = False
+
+    @staticmethod
+    def _compressible(status: int, headers: MutableHeaders) -> bool:
+        if status in (204, 206, 304) or "content-encoding" in headers:
+            return False
+        return headers.get("content-type", "").startswith(_COMPRESSIBLE_TYPES)
+
+    async def _pass_through(self) -> None:
+        start, self.start = self.start, None
+        self.passthrough = True
+        headers = MutableHeaders(raw=start["headers"])
+        if start["status"] == 304 and headers.get("etag") in self.unwrapped_etags:
+            # The client revalidated our encoded validator; answer with that same one
+            headers["ETag"] = encoded_etag(headers["etag"], self.encoding)
+        await self.send(start)
+
+    async def __call__(self, message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            # e.g. http.response.pathsend: nothing to compress, but the held start must go first
+            if self.start is not None:
+                await self._pass_through()
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+        if self.start is not None:
+            headers = MutableHeaders(raw=self.start["headers"])
+            if not self._compressible(self.start["status"], headers) or (not more and len(body) < self.minimum_size):
+                await self._pass_through()
+                await self.send(message)
+                return
+            start, self.start = self.start, None
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if "etag" in headers:
+                headers["ETag"] = encoded_etag(headers["etag"], self.encoding)
+            self.compressor = _Compressor(self.encoding)
+            if not more:
+                data = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(data))
+                await self.send(start)
+                await self.send({"type": "http.response.body", "body": data})
+                return
+            if "content-length" in headers:
+                del headers["content-length"]
+            await self.send(start)
+
+        # Streaming body (e.g. NDJSON): flush per chunk so rows still arrive as produced
+        data = self.compressor.compress(body) + (self.compressor.flush() if more else self.compressor.finish())
+        await self.send({"type": "http.response.body", "body": data, "more_body": more})
+
+
+class CompressionMiddleware:
+    """Negotiated brotli/gzip for text-like responses of at least `minimum_size` bytes.
+
+    Responses that already carry a Content-Encoding (precompressed assets,
+    the cached /products body) pass through untouched. A compressed response
+    gets an encoding-specific ETag; when a client revalidates with one, the
+    inner app is shown the plain tag too, so its own If-None-Match check (e.g.
+    StaticFiles') still produces a 304.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        scope, unwrapped = _unwrap_if_none_match(scope, encoding)
+        await self.app(scope, receive, _CompressingSend(send, encoding, self.minimum_size, unwrapped))
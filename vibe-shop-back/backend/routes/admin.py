@@ -1,118 +1,202 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query
-from fastapi.responses import JSONResponse
-from security import require_admin, oauth2_scheme
-from schemas import OrderItemOut, OrderOut
-from config import DB_FILE, DATA_FILE, BACK_TEE_IMAGES_DIR
-from utils import parse_items
-import sqlite3
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from responses import FastJSONResponse
+from security import require_admin, get_current_user, invalidate_user
+from schemas import OrderItemOut, OrderOut, ProductBulkUpdate, ProductUpdate, RoleUpdate, UserOut
+from config import BACK_TEE_IMAGES_DIR, UPLOAD_CHUNK_BYTES, UPLOAD_MAX_FILE_BYTES, UPLOAD_MAX_FILES, UPLOAD_MAX_REQUEST_BYTES
+from db import get_db, run_sqlite
+from catalog import catalog, product_rows
+from image_sync import image_sync
+from images import image_index
+from startup import startup_report
+from uploads import receive_files
+from variants import variant_index
+from warehouses import eta_cache
 import json
+import orjson
+import os
 import re
-from pathlib import Path
+import sqlite3
 from typing import Optional
-from jose import jwt
-from config import SECRET_KEY, ALGORITHM
 
 router = APIRouter()
 
 
+# Keyset pagination for admin listings: newest first, `after` is the last id seen
+ADMIN_PAGE_MAX = 1000
+_STREAM_BATCH = 500
+
+# Order lines as the JSON list clients already get, assembled from order_items
+_ITEMS_JSON = (
+    "(SELECT json_group_array(json_object('id', oi.product_id, 'name', oi.name, 'price', oi.price, 'qty', oi.qty))"
+    " FROM order_items oi WHERE oi.order_id = {table}.order_id)"
+)
+
+_ORDERS_SELECT = (
+    "SELECT id, order_id, address, " + _ITEMS_JSON.format(table="orders") + ", amount, created_at, geo_lat, geo_lon"
+    " FROM orders"
+)
+_PAYMENTS_SELECT = "SELECT id, order_id, status, amount, card_last4, card_brand, created_at FROM payments"
+
+
+def _order_row(r) -> dict:
+    _, order_id, address, items_raw, amount, created_at, geo_lat, geo_lon = r
+    return {
+        "order_id": order_id,
+        "address": address,
+        "items": json.loads(items_raw),
+        "amount": amount,
+        "created_at": created_at,
+        "geo_lat": geo_lat,
+        "geo_lon": geo_lon,
+    }
+
+
+def _payment_row(r) -> dict:
+    _, order_id, status, amount, card_last4, card_brand, created_at = r
+    return {
+        "order_id": order_id,
+        "status": status,
+        "amount": amount,
+        "card_last4": card_last4,
+        "card_brand": card_brand,
+        "created_at": created_at,
+    }
+
+
+def _keyset_rows(con, select: str, after: Optional[int], limit: Optional[int]) -> list:
+    sql = select
+    params: list = []
+    if after is not None:
+        sql += " WHERE id < ?"
+        params.append(after)
+    sql += " ORDER BY id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return con.execute(sql, params).fetchall()
+
+
+async def _stream_ndjson(select: str, to_dict, after: Optional[int], limit: Optional[int]):
+    # One short keyset query per batch: constant memory, no cursor held across threads
+    remaining = limit
+    while remaining is None or remaining > 0:
+        batch = _STREAM_BATCH if remaining is None else min(_STREAM_BATCH, remaining)
+        rows = await run_sqlite(_keyset_rows, select, after, batch)
+        for r in rows:
+            yield orjson.dumps(to_dict(r)) + b"\n"
+        if len(rows) < batch:
+            return
+        after = rows[-1][0]
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+async def _listing(select: str, to_dict, after: Optional[int], limit: Optional[int], fmt: str):
+    if fmt == "ndjson":
+        return StreamingResponse(_stream_ndjson(select, to_dict, after, limit), media_type="application/x-ndjson")
+    rows = await run_sqlite(_keyset_rows, select, after, limit)
+    headers = {}
+    if limit is not None and len(rows) == limit:
+        headers["X-Next-Cursor"] = str(rows[-1][0])
+    return FastJSONResponse(content=[to_dict(r) for r in rows], headers=headers)
+
+
 @router.get("/admin/orders")
-def admin_orders(_: str = Depends(require_admin)):
-    con = sqlite3.connect(DB_FILE)
-    cur = con.cursor()
-    cur.execute(
-        "SELECT order_id, address, items, amount, created_at, geo_lat, geo_lon FROM orders ORDER BY id DESC"
-    )
-    rows = cur.fetchall()
-    con.close()
-    result = []
-    for r in rows:
-        order_id, address, items_raw, amount, created_at, geo_lat, geo_lon = r
-        result.append(
-            {
-                "order_id": order_id,
-                "address": address,
-                "items": parse_items(items_raw),
-                "amount": amount,
-                "created_at": created_at,
-                "geo_lat": geo_lat,
-                "geo_lon": geo_lon,
-            }
-        )
-    return result
+async def admin_orders(
+    limit: Optional[int] = Query(None, ge=1, le=ADMIN_PAGE_MAX),
+    after: Optional[int] = Query(None, description="Return orders with id below this cursor"),
+    fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    _: str = Depends(require_admin),
+):
+    return await _listing(_ORDERS_SELECT, _order_row, after, limit, fmt)
 
 
 @router.get("/admin/payments")
-def admin_payments(_: str = Depends(require_admin)):
-    con = sqlite3.connect(DB_FILE)
-    cur = con.cursor()
-    cur.execute(
-        "SELECT order_id, status, amount, card_last4, card_brand, created_at FROM payments ORDER BY id DESC"
-    )
-    rows = cur.fetchall()
-    con.close()
-    result = []
-    for r in rows:
-        order_id, status, amount, card_last4, card_brand, created_at = r
-        result.append(
-            {
-                "order_id": order_id,
-                "status": status,
-                "amount": amount,
-                "card_last4": card_last4,
-                "card_brand": card_brand,
-                "created_at": created_at,
-            }
-        )
-    return result
+async def admin_payments(
+    limit: Optional[int] = Query(None, ge=1, le=ADMIN_PAGE_MAX),
+    after: Optional[int] = Query(None, description="Return payments with id below this cursor"),
+    fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    _: str = Depends(require_admin),
+):
+    return await _listing(_PAYMENTS_SELECT, _payment_row, after, limit, fmt)
 
 
-@router.get("/my-orders")
-def my_orders(token: str = Depends(oauth2_scheme)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=401, detail="Invalid token")
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    con = sqlite3.connect(DB_FILE)
-    cur = con.cursor()
-    cur.execute(
-        "SELECT order_id, address, items, amount, created_at FROM orders WHERE username = ? ORDER BY id DESC",
+def _product_stats(con, limit: int) -> list:
+    # Best sellers straight from order_items; the (product_id, qty, price) index covers it
+    return con.execute(
+        """
+        SELECT product_id, SUM(qty) AS units, SUM(qty * price) AS revenue, COUNT(*) AS lines
+        FROM order_items
+        GROUP BY product_id
+        ORDER BY units DESC, product_id
+        LIMIT ?
+        """,
+        (limit,),
+    ).fetchall()
+
+
+@router.get("/admin/stats/products")
+async def admin_product_stats(
+    limit: int = Query(20, ge=1, le=ADMIN_PAGE_MAX),
+    _: str = Depends(require_admin),
+):
+    rows = await run_sqlite(_product_stats, limit)
+    return [
+        {"product_id": pid, "units": units, "revenue": revenue, "order_lines": lines}
+        for pid, units, revenue, lines in rows
+    ]
+
+
+@router.get("/admin/stats/eta-cache")
+def admin_eta_cache_stats(_: str = Depends(require_admin)):
+    return eta_cache.stats()
+
+
+@router.get("/admin/stats/startup")
+def admin_startup_report(_: str = Depends(require_admin)):
+    return startup_report.as_dict()
+
+
+@router.get("/admin/stats/image-sync")
+def admin_image_sync_status(_: str = Depends(require_admin)):
+    return image_sync.status()
+
+
+def _user_orders(con, username: str) -> list:
+    # Each order joined with its latest payment and its lines in a single query,
+    # served by the orders(username, id), payments(order_id, id) and
+    # order_items(order_id) indexes
+    return con.execute(
+        f"""
+        SELECT t.order_id, t.address, {_ITEMS_JSON.format(table="t")}, t.amount, t.created_at,
+               t.p_status, t.p_card_last4, t.p_card_brand, t.p_created_at
+        FROM (
+            SELECT o.id AS oid, o.order_id, o.address, o.amount, o.created_at,
+                   p.status AS p_status, p.card_last4 AS p_card_last4,
+                   p.card_brand AS p_card_brand, p.created_at AS p_created_at,
+                   ROW_NUMBER() OVER (PARTITION BY o.id ORDER BY p.id DESC) AS rn
+            FROM orders o
+            LEFT JOIN payments p ON p.order_id = o.order_id
+            WHERE o.username = ?
+        ) t
+        WHERE t.rn = 1
+        ORDER BY t.oid DESC
+        """,
         (username,),
-    )
-    rows = cur.fetchall()
+    ).fetchall()
+
+
+@router.get("/my-orders")
+async def my_orders(user: UserOut = Depends(get_current_user)):
+    rows = await run_sqlite(_user_orders, user.username)
 
     results: list[OrderOut] = []
     for r in rows:
-        order_id, address, items_raw, amount, created_at = r
-        parsed_items = parse_items(items_raw)
-        items: list[OrderItemOut] = []
-        for it in parsed_items:
-            try:
-                items.append(
-                    OrderItemOut(
-                        id=int(it.get("id")),
-                        name=str(it.get("name")),
-                        price=int(it.get("price")),
-                        qty=int(it.get("qty", 1)),
-                    )
-                )
-            except Exception:
-                pass
-
-        # Last payment info for this order
-        cur2 = con.cursor()
-        cur2.execute(
-            "SELECT status, card_last4, card_brand, created_at FROM payments WHERE order_id = ? ORDER BY id DESC LIMIT 1",
-            (order_id,),
-        )
-        p = cur2.fetchone()
-        payment_status = p[0] if p else None
-        payment_last4 = p[1] if p else None
-        payment_brand = p[2] if p else None
-        payment_created = p[3] if p else None
+        (order_id, address, items_raw, amount, created_at,
+         payment_status, payment_last4, payment_brand, payment_created) = r
+        items = [OrderItemOut(**it) for it in json.loads(items_raw)]
 
         results.append(
             OrderOut(
@@ -128,157 +212,161 @@ def my_orders(token: str = Depends(oauth2_scheme)):
             )
         )
 
-    con.close()
     return results
 
 
 # ===== Admin: Products management =====
 
-def _scan_images_map() -> dict[str, list[str]]:
-    images_map: dict[str, list[str]] = {}
-    try:
-        scan_dir = BACK_TEE_IMAGES_DIR
-        scan_dir.mkdir(parents=True, exist_ok=True)
-        files = [p.name for p in scan_dir.iterdir() if p.is_file()]
-        tmp: dict[str, list[str]] = {}
-        for name in files:
-            if not re.search(r"\.(jpe?g|png|webp)$", name, flags=re.I):
-                continue
-            parts = name.split("_", 1)
-            if len(parts) < 2:
-                continue
-            key = parts[0]
-            tmp.setdefault(key, []).append(name)
-        for key, names in tmp.items():
-            def sort_key(n: str):
-                m = re.search(r"_(\d+)", n)
-                return (int(m.group(1)) if m else 0, n)
-            sorted_names = sorted(names, key=sort_key)
-            images_map[key] = [f"/images/tees/images/{n}" for n in sorted_names]
-    except Exception:
-        images_map = {}
-    return images_map
+@router.get("/admin/products")
+async def admin_products(_: str = Depends(require_admin)):
+    # The index may rescan the image directory; keep that and the query off the event loop
+    images_map = await run_in_threadpool(image_index.urls_map)
+    rows = await run_sqlite(product_rows)
+    result = [
+        {
+            "index": position,
+            "id": pid,
+            "slug": slug,
+            "name": name,
+            "price": price,
+            "description": description,
+            "images": images_map.get(str(pid)) or orjson.loads(extra or "{}").get("images") or [],
+        }
+        for pid, position, slug, name, price, description, extra in rows
+    ]
+    return FastJSONResponse(content=result)
 
 
-@router.get("/admin/products")
-def admin_products(_: str = Depends(require_admin)):
+def _update_product(con, product_id: int, changes: dict) -> None:
+    if not con.execute("SELECT 1 FROM products WHERE id = ?", (product_id,)).fetchone():
+        raise HTTPException(status_code=404, detail=f"Product {product_id} not found")
+    if not changes:
+        return
+    cols = ", ".join(f"{k} = ?" for k in changes)
     try:
-        with DATA_FILE.open(encoding="utf-8") as f:
-            data = json.load(f)
-        if not isinstance(data, list):
-            data = []
-    except Exception:
-        data = []
-
-    images_map = _scan_images_map()
-    ordered_groups = sorted(images_map.keys(), key=lambda k: int(k)) if images_map else []
-
-    result = []
-    for i, item in enumerate(data):
-        item = dict(item)
-        pid: Optional[int] = None
-        imgs: list[str] = []
-        if i < len(ordered_groups):
-            gid = ordered_groups[i]
-            pid = int(gid)
-            imgs = images_map.get(gid, [])
-        else:
-            pid = i
-            imgs = item.get("images") or []
-        result.append(
-            {
-                "index": i,  # position in products.json
-                "id": pid,    # numeric id tied to image group when available
-                "name": item.get("name"),
-                "price": item.get("price"),
-                "description": item.get("description"),
-                "images": imgs,
-            }
-        )
-    return JSONResponse(content=result)
+        con.execute(f"UPDATE products SET {cols} WHERE id = ?", (*changes.values(), product_id))
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail=f"Slug {changes.get('slug')!r} is already taken")
 
 
-@router.put("/admin/products/{index}")
-def admin_update_product(index: int, payload: dict, _: str = Depends(require_admin)):
-    # Update name, price, description for item at given index in products.json
-    try:
-        with DATA_FILE.open(encoding="utf-8") as f:
-            data = json.load(f)
-        if not isinstance(data, list):
-            raise HTTPException(status_code=500, detail="Invalid products.json format")
-        if index < 0 or index >= len(data):
-            raise HTTPException(status_code=404, detail="Product index out of range")
-        item = dict(data[index]) if isinstance(data[index], dict) else {}
-        for key in ("name", "price", "description"):
-            if key in payload:
-                item[key] = payload[key]
-        data[index] = item
-        DATA_FILE.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-        return {"status": "ok"}
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+def _apply_product_updates(con, updates: list[tuple[int, dict]]) -> None:
+    # Runs as one run_sqlite transaction: any failing row rolls back the whole batch
+    for product_id, changes in updates:
+        _update_product(con, product_id, changes)
+
+
+@router.post("/admin/products/bulk-update")
+async def admin_bulk_update_products(updates: list[ProductBulkUpdate], _: str = Depends(require_admin)):
+    batch = [(u.id, u.model_dump(exclude_unset=True, exclude={"id"})) for u in updates]
+    await run_sqlite(_apply_product_updates, batch)
+    catalog.invalidate()
+    return {"status": "ok", "updated": len(batch)}
+
+
+@router.put("/admin/products/{product_id}")
+async def admin_update_product(product_id: int, payload: ProductUpdate, _: str = Depends(require_admin)):
+    await run_sqlite(_apply_product_updates, [(product_id, payload.model_dump(exclude_unset=True))])
+    catalog.invalidate()
+    return {"status": "ok"}
+
+
+_IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def _discard(paths) -> None:
+    for p in paths:
+        try:
+            os.unlink(p)
+        except OSError:
+            pass
 
 
-@router.post("/admin/products/{pid}/images")
+# The body is parsed by uploads.receive_files, not FastAPI, so describe it for the docs by hand
+_IMAGE_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+            "required": ["files"],
+        }}},
+    }
+}
+
+
+@router.post("/admin/products/{pid}/images", openapi_extra=_IMAGE_UPLOAD_BODY)
 async def admin_replace_images(
     pid: int,
-    files: list[UploadFile] = File(...),
+    request: Request,
     replace: bool = Query(True, description="Replace existing images for this product id"),
     _: str = Depends(require_admin),
 ):
     # Save uploaded images for product id as <pid>_1.ext, <pid>_2.ext ...
-    BACK_TEE_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+    # Every file is staged first so a rejected upload leaves the current images untouched
+    staged = await receive_files(
+        request,
+        BACK_TEE_IMAGES_DIR,
+        _IMAGE_SUFFIXES,
+        max_file_bytes=UPLOAD_MAX_FILE_BYTES,
+        max_request_bytes=UPLOAD_MAX_REQUEST_BYTES,
+        max_files=UPLOAD_MAX_FILES,
+        chunk_bytes=UPLOAD_CHUNK_BYTES,
+    )
 
     # Optionally remove existing images for this id
     if replace:
-        for p in BACK_TEE_IMAGES_DIR.iterdir():
-            if p.is_file() and p.name.startswith(f"{pid}_"):
-                try:
-                    p.unlink()
-                except Exception:
-                    pass
-
-    counter = 1
-    # find max existing suffix to continue numbering if not replacing
-    if not replace:
-        for p in BACK_TEE_IMAGES_DIR.iterdir():
-            m = re.match(rf"^{pid}_(\d+)\.", p.name)
-            if m:
-                try:
-                    counter = max(counter, int(m.group(1)) + 1)
-                except Exception:
-                    pass
+        for name in image_index.files(pid):
+            try:
+                (BACK_TEE_IMAGES_DIR / name).unlink()
+            except FileNotFoundError:
+                pass
+            except Exception:
+                continue
+            image_index.remove(name)
+            variant_index.remove(name)
+
+    # continue numbering after the existing suffixes (an index lookup, no directory scan)
+    counter = image_index.next_index(pid)
 
     saved = []
-    for f in files:
+    for path, suffix in staged:
+        name = f"{pid}_{counter}{suffix}"
         try:
-            suffix = Path(f.filename).suffix.lower()
-            if suffix not in (".jpg", ".jpeg", ".png", ".webp"):
-                continue
-            name = f"{pid}_{counter}{suffix}"
-            target = BACK_TEE_IMAGES_DIR / name
-            with open(target, "wb") as out:
-                out.write(await f.read())
-            saved.append(f"/images/tees/images/{name}")
-            counter += 1
-        except Exception:
+            os.replace(path, BACK_TEE_IMAGES_DIR / name)
+        except OSError:
+            _discard([path])
             continue
-    return {"saved": saved}
+        image_index.add(name)
+        saved.append(name)
+        counter += 1
+    # Resized/WebP/AVIF copies are encoded off the request; /products lists them once written
+    variant_index.schedule(saved)
+    catalog.invalidate()
+    return {"saved": [f"/images/tees/images/{name}" for name in saved]}
+
+
+@router.post("/admin/images/variants")
+def admin_build_variants(_: str = Depends(require_admin)):
+    """Queue variant builds for every format a tee image has none of yet; returns the job count."""
+    names = [name for pid in image_index.urls_map() for name in image_index.files(pid)]
+    return {"scheduled": len(variant_index.schedule(names, missing_only=True))}
 
 
 @router.delete("/admin/products/{pid}/images")
 def admin_delete_all_images(pid: int, _: str = Depends(require_admin)):
     BACK_TEE_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
     deleted = 0
-    for p in BACK_TEE_IMAGES_DIR.iterdir():
-        if p.is_file() and p.name.startswith(f"{pid}_"):
-            try:
-                p.unlink()
-                deleted += 1
-            except Exception:
-                pass
+    for name in image_index.files(pid):
+        try:
+            (BACK_TEE_IMAGES_DIR / name).unlink()
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        except Exception:
+            continue
+        image_index.remove(name)
+        variant_index.remove(name)
+    catalog.invalidate()
     return {"deleted": deleted}
 
 
@@ -292,6 +380,23 @@ def admin_delete_image(pid: int, filename: str, _: str = Depends(require_admin))
         raise HTTPException(status_code=400, detail="Filename does not match product id")
     try:
         p.unlink()
+        image_index.remove(p.name)
+        variant_index.remove(p.name)
+        catalog.invalidate()
         return {"deleted": filename}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.put("/admin/users/{username}/role", response_model=UserOut)
+def admin_set_role(username: str, body: RoleUpdate, db=Depends(get_db), _: str = Depends(require_admin)):
+    from users_db import User
+
+    user = db.query(User).filter(User.username == username).first()
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    user.role = body.role
+    db.commit()
+    # Cached tokens still carry the old role
+    invalidate_user(username)
+    return UserOut(id=user.id, username=user.username, role=user.role)
@@ -1,31 +1,54 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Body
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
-from db import User, get_db
+from passwords import hash_password_async, verify_and_update_async
 from schemas import UserCreate, UserOut, Token
-from security import verify_password, get_password_hash, create_access_token, oauth2_scheme, get_current_user
+from security import create_access_token, get_current_user
 
 router = APIRouter()
 
 
+# users_db (SQLAlchemy) is imported on first use, not at app startup
+def _find_user(username: str):
+    from users_db import SessionLocal, User
+
+    with SessionLocal() as db:
+        return db.query(User).filter(User.username == username).first()
+
+
+def _create_user(username: str, password_hash: str):
+    from users_db import SessionLocal, User
+
+    with SessionLocal() as db:
+        new_user = User(username=username, password_hash=password_hash, role="user")
+        db.add(new_user)
+        db.commit()
+        db.refresh(new_user)
+        return new_user
+
+
+def _set_password_hash(user_id: int, password_hash: str) -> None:
+    from users_db import SessionLocal, User
+
+    with SessionLocal() as db:
+        db.query(User).filter(User.id == user_id).update({User.password_hash: password_hash})
+        db.commit()
+
+
+# bcrypt runs in the password process pool and the small users.db queries on
+# the threadpool, so neither holds a request thread while hashing
 @router.post("/register", response_model=UserOut)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if db_user:
+async def register(user: UserCreate):
+    if await run_in_threadpool(_find_user, user.username):
         raise HTTPException(status_code=400, detail="Username already registered")
  
-    hashed_pw = get_password_hash(user.password)
-    new_user = User(username=user.username, password_hash=hashed_pw, role="user")
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
+    hashed_pw = await hash_password_async(user.password)
+    return await run_in_threadpool(_create_user, user.username, hashed_pw)
 
 
 @router.post("/token", response_model=Token)
-def login(
+async def login(
     request: Request,
-    db: Session = Depends(get_db),
     form_data: OAuth2PasswordRequestForm = Depends(),  # не обязательно
     username: str = Body(None),
     password: str = Body(None),
@@ -41,16 +64,21 @@ def login(
     else:
         raise HTTPException(status_code=422, detail="username and password required")
 
-    user = db.query(User).filter(User.username == uname).first()
-    if not user or not verify_password(passwd, user.password_hash):
+    user = await run_in_threadpool(_find_user, uname)
+    if not user:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    ok, new_hash = await verify_and_update_async(passwd, user.password_hash)
+    if not ok:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
+    if new_hash:
+        # Stored with an outdated bcrypt cost; upgrade it now that we know the password
+        await run_in_threadpool(_set_password_hash, user.id, new_hash)
 
     token = create_access_token({"sub": user.username, "role": user.role})
     return {"access_token": token, "token_type": "bearer"}
 
 
 @router.get("/me", response_model=UserOut)
-def read_users_me(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user = get_current_user(token=token, db=db)
+def read_users_me(user: UserOut = Depends(get_current_user)):
     return user
 
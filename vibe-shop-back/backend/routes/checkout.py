@@ -1,11 +1,12 @@
-from fastapi import APIRouter, HTTPException, Header
-from fastapi.responses import JSONResponse
-from schemas import CheckoutRequest, CheckoutResponse, PayRequest, PayResponse, DeliveryEtaRequest, DeliveryEtaResponse
-from config import DB_FILE
-from utils import detect_brand, calc_eta, parse_items
-import sqlite3
+from fastapi import APIRouter, HTTPException, Header, Query
+from responses import FastJSONResponse
+from schemas import CheckoutRequest, CheckoutResponse, PayRequest, PayResponse, DeliveryEtaRequest, DeliveryEtaResponse, DeliveryEtaBatchRequest
+from db import run_sqlite
+from utils import detect_brand
+from warehouses import eta_cache, route_eta_batch
+from payments import payment_processor, DECLINE_CARD, DECLINE_BRAND, MESSAGES
+from config import DELIVERY_ETA_BATCH_MAX, PAYMENT_WAIT_MAX_S
 import datetime
-import json
 import random
 import asyncio
 
@@ -13,13 +14,48 @@ router = APIRouter()
 
 
 @router.post("/delivery-eta", response_model=DeliveryEtaResponse)
-def delivery_eta(req: DeliveryEtaRequest):
-    days, eta_date, distance = calc_eta(req.items, req.geo_lat, req.geo_lon)
-    return DeliveryEtaResponse(distance_km=distance, eta_days=days, eta_date=eta_date)
+async def delivery_eta(req: DeliveryEtaRequest):
+    days, eta_date, distance, warehouse_id = eta_cache.route_eta(req.items, req.geo_lat, req.geo_lon)
+    return DeliveryEtaResponse(distance_km=distance, eta_days=days, eta_date=eta_date, warehouse_id=warehouse_id)
+
+
+@router.post("/delivery-eta/batch", response_model=list[DeliveryEtaResponse])
+def delivery_eta_batch(req: DeliveryEtaBatchRequest):
+    """ETAs for many destinations, in request order (same numbers as /delivery-eta)."""
+    if len(req.destinations) > DELIVERY_ETA_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {DELIVERY_ETA_BATCH_MAX} destinations per request")
+    results = route_eta_batch([(d.geo_lat, d.geo_lon, d.items) for d in req.destinations])
+    # Thousands of rows: skip per-row model validation on the way out
+    return FastJSONResponse(content=[
+        {"distance_km": distance, "eta_days": days, "eta_date": eta_date, "warehouse_id": warehouse_id}
+        for days, eta_date, distance, warehouse_id in results
+    ])
+
+
+def _insert_order(con, order_id: str, req: CheckoutRequest, amount: int, created_at: str, warehouse_id: str | None) -> None:
+    # Lines live only in order_items; the legacy orders.items column is left
+    # NULL (migration 3 moved its old contents over)
+    con.execute(
+        "INSERT INTO orders (order_id, address, amount, created_at, geo_lat, geo_lon, username, warehouse_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            order_id,
+            req.address,
+            amount,
+            created_at,
+            str(req.geo_lat) if req.geo_lat is not None else None,
+            str(req.geo_lon) if req.geo_lon is not None else None,
+            None,
+            warehouse_id,
+        ),
+    )
+    con.executemany(
+        "INSERT INTO order_items (order_id, product_id, name, price, qty) VALUES (?, ?, ?, ?, ?)",
+        [(order_id, i.id, i.name, i.price, i.qty) for i in req.items],
+    )
 
 
 @router.post("/checkout", response_model=CheckoutResponse)
-def checkout(req: CheckoutRequest, authorization: str | None = Header(default=None)):
+async def checkout(req: CheckoutRequest, authorization: str | None = Header(default=None)):
     if not req.items:
         raise HTTPException(status_code=400, detail="Корзина пуста")
 
@@ -27,80 +63,86 @@ def checkout(req: CheckoutRequest, authorization: str | None = Header(default=No
     order_id = f"ORD-{int(datetime.datetime.utcnow().timestamp())}-{random.randint(100,999)}"
 
     created_at = datetime.datetime.utcnow().isoformat()
-    con = sqlite3.connect(DB_FILE)
-    cur = con.cursor()
-    cur.execute(
-        "INSERT INTO orders (order_id, address, items, amount, created_at, geo_lat, geo_lon, username) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-        (
-            order_id,
-            req.address,
-            json.dumps([i.dict() for i in req.items], ensure_ascii=False),
-            amount,
-            created_at,
-            str(req.geo_lat) if req.geo_lat is not None else None,
-            str(req.geo_lon) if req.geo_lon is not None else None,
-            None,
-        ),
+    days, eta_date, distance, warehouse_id = eta_cache.route_eta(req.items, req.geo_lat, req.geo_lon) if (req.geo_lat is not None and req.geo_lon is not None) else (None, None, None, None)
+    await run_sqlite(_insert_order, order_id, req, amount, created_at, warehouse_id)
+
+    return CheckoutResponse(
+        order_id=order_id, amount=amount, eta_days=days, eta_date=eta_date, distance_km=distance, warehouse_id=warehouse_id
     )
-    con.commit()
-    con.close()
 
-    days, eta_date, distance = calc_eta(req.items, req.geo_lat, req.geo_lon) if (req.geo_lat is not None and req.geo_lon is not None) else (None, None, None)
-    return CheckoutResponse(order_id=order_id, amount=amount, eta_days=days, eta_date=eta_date, distance_km=distance)
 
+def _insert_pending_payment(con, order_id: str, last4: str, brand: str, created_at: str) -> int:
+    cur = con.execute(
+        "INSERT INTO payments (order_id, status, amount, card_last4, card_brand, created_at, message) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (order_id, "pending", 0, last4, brand, created_at, MESSAGES["pending"])
+    )
+    return cur.lastrowid
 
-    
-@router.post("/pay-mock", response_model=PayResponse)
-async def pay_mock(req: PayRequest):
-    # задержка от 5 до 10 секунд
-    delay = random.randint(10, 15)
-    await asyncio.sleep(delay)
 
+@router.post("/pay-mock", response_model=PayResponse, status_code=202)
+async def pay_mock(req: PayRequest):
+    # Only validate and enqueue here; the processor settles the payment after
+    # its simulated latency and GET /payments/{id} reports the outcome
     card = req.card_number.replace(" ", "")
-    if card == "4000000000009995":
-        brand = "visa_decline"
-        status = "declined"
-        message = "Платёж отклонён"
-        txn = None
+    if card == DECLINE_CARD:
+        brand = DECLINE_BRAND
     else:
         brand = detect_brand(card)
         if brand == 'unknown' or (not card.isdigit()) or len(card) != 16:
             raise HTTPException(status_code=400, detail="Номер карты некорректен")
-        status = "succeeded"
-        txn = f"TXN-{random.randint(1000000,9999999)}"
 
     last4 = card[-4:]
     created_at = datetime.datetime.utcnow().isoformat()
-    con = sqlite3.connect(DB_FILE)
-    cur = con.cursor()
-    cur.execute(
-        "INSERT INTO payments (order_id, status, amount, card_last4, card_brand, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-        (req.order_id, status, 0, last4, brand, created_at)
+    payment_id = await run_sqlite(_insert_pending_payment, req.order_id, last4, brand, created_at)
+    payment_processor.submit(payment_id)
+    return PayResponse(status="pending", message=MESSAGES["pending"], payment_id=payment_id, order_id=req.order_id)
+
+
+def _payment_row(con, payment_id: int):
+    return con.execute(
+        """
+        SELECT p.order_id, p.status, p.message, p.transaction_id, o.eta_date, o.warehouse_id
+        FROM payments p LEFT JOIN orders o ON o.order_id = p.order_id
+        WHERE p.id = ?
+        """,
+        (payment_id,),
+    ).fetchone()
+
+
+async def _payment_status(payment_id: int) -> PayResponse | None:
+    row = await run_sqlite(_payment_row, payment_id)
+    if not row:
+        return None
+    order_id, status, message, txn, eta_date, warehouse_id = row
+    return PayResponse(
+        status=status,
+        message=message or MESSAGES.get(status, status),
+        transaction_id=txn,
+        delivery_time=eta_date if status == "succeeded" else None,
+        payment_id=payment_id,
+        order_id=order_id,
+        warehouse_id=warehouse_id,
     )
-    con.commit()
-    con.close()
 
-    con = sqlite3.connect(DB_FILE)
-    cur = con.cursor()
-    cur.execute("SELECT items, geo_lat, geo_lon FROM orders WHERE order_id = ?", (req.order_id,))
-    row = cur.fetchone()
-    con.close()
 
-    items_for_calc = []
+@router.get("/payments/{payment_id}", response_model=PayResponse)
+async def payment_status(
+    payment_id: int,
+    wait: float = Query(0, ge=0, le=PAYMENT_WAIT_MAX_S, description="Long-poll up to this many seconds while pending"),
+):
+    settled = payment_processor.waiter(payment_id) if wait else None
     try:
-        itms = json.loads(row[0]) if row and row[0] else []
-        for it in itms:
-            class _I: ...
-            o = _I(); o.id = it.get("id"); o.qty = it.get("qty", 1); items_for_calc.append(o)
-    except Exception:
-        pass
-    geo_lat = None; geo_lon = None
-    try:
-        geo_lat = float(row[1]) if row and row[1] is not None else None
-        geo_lon = float(row[2]) if row and row[2] is not None else None
-    except Exception:
-        pass
-    days, delivery, _ = calc_eta(items_for_calc, geo_lat, geo_lon)
-    return PayResponse(status=status, message=message, transaction_id=txn, delivery_time=delivery)
-
-
+        result = await _payment_status(payment_id)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        if settled is not None and result.status == "pending":
+            try:
+                await asyncio.wait_for(settled.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            # Re-read either way: it may have settled right as the wait ran out
+            result = await _payment_status(payment_id)
+        return result
+    finally:
+        if settled is not None:
+            payment_processor.release_waiter(payment_id)
@@ -1,10 +1,16 @@
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
-from pathlib import Path
-import json
+import base64
 import re
+from typing import Literal, Optional
 
-from config import DATA_FILE, BACK_TEE_IMAGES_DIR, FRONT_TEE_IMAGES_DIR
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+
+from catalog import catalog, etag_matches
+from config import COMPRESSION_MIN_BYTES, SEARCH_PAGE_MAX, SEARCH_PAGE_SIZE, SEARCH_PRICE_BUCKETS
+from db import run_sqlite
+from responses import FastJSONResponse, compress, encoded_etag, negotiate_encoding
 
 router = APIRouter()
 
@@ -14,74 +20,146 @@ async def health() -> dict:
     return {"status": "ok"}
 
 
+def _cached_json(request: Request, body: bytes, etag: str, encode) -> Response:
+    """Conditional JSON response for a cached body; `encode(encoding)` -> (body, etag)."""
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if encoding and len(body) >= COMPRESSION_MIN_BYTES:
+        # Served compressed here; the middleware leaves encoded bodies alone
+        body, etag = encode(encoding)
+        etag = encoded_etag(etag, encoding)
+    else:
+        encoding = None
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @router.get("/products")
-async def products():
+def products(request: Request):
     try:
-        with DATA_FILE.open(encoding="utf-8") as f:
-            data = json.load(f)
-
-        images_map: dict[str, list[str]] = {}
-        try:
-            scan_dir = BACK_TEE_IMAGES_DIR if BACK_TEE_IMAGES_DIR.exists() else FRONT_TEE_IMAGES_DIR
-            if scan_dir.exists():
-                files = [p.name for p in scan_dir.iterdir() if p.is_file()]
-                tmp: dict[str, list[str]] = {}
-                for name in files:
-                    if not re.search(r"\.(jpe?g|png|webp)$", name, flags=re.I):
-                        continue
-                    parts = name.split("_", 1)
-                    if len(parts) < 2:
-                        continue
-                    key = parts[0]
-                    tmp.setdefault(key, []).append(name)
-                for key, names in tmp.items():
-                    def sort_key(n: str) -> tuple[int, str]:
-                        m = re.search(r"_(\d+)", n)
-                        return (int(m.group(1)) if m else 0, n)
-                    sorted_names = sorted(names, key=sort_key)
-
-                    # Heuristic: consider index _6 or keyworded filenames as size-chart
-                    def is_chart(n: str) -> bool:
-                        if re.search(r"_(6)\.", n):
-                            return True
-                        return re.search(r"(chart|size|sizing|dimension|guide|table|таблиц|размер)", n, flags=re.I) is not None
-
-                    chart = next((n for n in sorted_names if is_chart(n)), None)
-                    non_chart = [n for n in sorted_names if n != chart]
-                    take = 4 if chart else 5
-                    picked = [n for n in non_chart if re.search(r"_(\d+)\.", n)][:take]
-                    if chart:
-                        picked.append(chart)
-                    if len(picked) == 5:
-                        images_map[key] = [f"/images/tees/images/{n}" for n in picked]
-        except Exception:
-            images_map = {}
-
-        ordered_groups = sorted(images_map.keys(), key=lambda k: int(k)) if images_map else []
-
-        def slugify(name: str) -> str:
-            s = re.sub(r"[^a-zA-Z0-9]+", "-", name).strip("-")
-            return s.lower()
-
-        result = []
-        for i, item in enumerate(data if isinstance(data, list) else []):
-            item = dict(item)
-            if i < len(ordered_groups):
-                gid = ordered_groups[i]
-                imgs = images_map.get(gid) or []
-                item["id"] = int(gid)
-                if imgs:
-                    item["images"] = imgs
-                    item["image"] = imgs[0]
-            else:
-                item.setdefault("id", i)
-                imgs = item.get("images") or []
-                if imgs:
-                    item["image"] = imgs[0]
-            if item.get("name"):
-                item["slug"] = slugify(str(item["name"]))
-            result.append(item)
-
-        return JSONResponse(content=result)
+        body, etag = catalog.get()
+        return _cached_json(request, body, etag, catalog.get_encoded)
     except Exception as e:
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+        return FastJSONResponse(content={"error": str(e)}, status_code=500)
+
+
+def _product_response(request: Request, entry: tuple[bytes, str] | None) -> Response:
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    body, etag = entry
+    return _cached_json(request, body, etag, lambda encoding: (compress(body, encoding), etag))
+
+
+# Sort key per `sort`; results page on (key, id) so a cursor is just the last pair.
+# A NULL key (a product without a price) sorts after every other key
+_SORT_KEYS = {
+    "relevance": "bm25(products_fts, 5.0, 1.0)",
+    "price_asc": "p.price",
+    "price_desc": "-p.price",
+    "name": "lower(p.name)",
+}
+_WORD_RE = re.compile(r"\w+")
+
+
+def _match_query(q: Optional[str]) -> Optional[str]:
+    # Every word must match, each as a prefix; quoting keeps FTS5 syntax out of user input
+    words = _WORD_RE.findall(q or "")
+    return " ".join(f'"{w}"*' for w in words) or None
+
+
+def _encode_cursor(key, product_id: int) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps([key, product_id])).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        key, product_id = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return key, int(product_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _bucket_case() -> str:
+    edges = SEARCH_PRICE_BUCKETS
+    whens = " ".join(f"WHEN p.price < {int(edge)} THEN {i}" for i, edge in enumerate(edges))
+    return f"CASE {whens} ELSE {len(edges)} END"
+
+
+def _search(con, match, min_price, max_price, sort, limit, after) -> tuple[list, int, dict]:
+    """(page of (id, key) rows, total matches, {bucket: count}) for one search."""
+    source = "products p"
+    params: list = []
+    if match:
+        source = "products_fts JOIN products p ON p.id = products_fts.rowid AND products_fts MATCH ?"
+        params.append(match)
+    key = _SORT_KEYS[sort] if match or sort != "relevance" else "p.position"
+
+    # Facets count every text match, whatever price range is selected
+    facets = dict(con.execute(f"SELECT {_bucket_case()}, COUNT(*) FROM {source} GROUP BY 1", params).fetchall())
+
+    where, wparams = [], []
+    if min_price is not None:
+        where.append("p.price >= ?")
+        wparams.append(min_price)
+    if max_price is not None:
+        where.append("p.price <= ?")
+        wparams.append(max_price)
+    filtered = f"SELECT p.id AS id, {key} AS key FROM {source}" + (" WHERE " + " AND ".join(where) if where else "")
+    total = con.execute(f"SELECT COUNT(*) FROM ({filtered})", params + wparams).fetchone()[0]
+
+    sql = f"SELECT id, key FROM ({filtered})"
+    page_params = params + wparams
+    if after is not None:
+        after_key, after_id = after
+        # Row-value comparison against NULL is NULL, so the NULL-key tail pages on id alone
+        if after_key is None:
+            sql += " WHERE key IS NULL AND id > ?"
+            page_params += [after_id]
+        else:
+            sql += " WHERE key IS NULL OR (key, id) > (?, ?)"
+            page_params += [after_key, after_id]
+    sql += " ORDER BY key IS NULL, key, id LIMIT ?"
+    rows = con.execute(sql, page_params + [limit]).fetchall()
+    return rows, total, facets
+
+
+def _price_facets(counts: dict) -> list[dict]:
+    edges = (0, *SEARCH_PRICE_BUCKETS)
+    return [
+        {"min": lo, "max": edges[i + 1] - 1 if i + 1 < len(edges) else None, "count": counts.get(i, 0)}
+        for i, lo in enumerate(edges)
+    ]
+
+
+@router.get("/products/search")
+async def search_products(
+    q: Optional[str] = Query(None, max_length=200),
+    min_price: Optional[int] = Query(None, ge=0),
+    max_price: Optional[int] = Query(None, ge=0),
+    sort: Literal["relevance", "price_asc", "price_desc", "name"] = "relevance",
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_PAGE_MAX),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+):
+    after = _decode_cursor(cursor) if cursor else None
+    rows, total, counts = await run_sqlite(_search, _match_query(q), min_price, max_price, sort, limit, after)
+    by_id = await run_in_threadpool(catalog.products_by_id)
+    return {
+        "items": [by_id[pid] for pid, _ in rows if pid in by_id],
+        "total": total,
+        "facets": {"price": _price_facets(counts)},
+        "next_cursor": _encode_cursor(rows[-1][1], rows[-1][0]) if len(rows) == limit else None,
+    }
+
+
+@router.get("/products/by-slug/{slug}")
+def product_by_slug(slug: str, request: Request):
+    return _product_response(request, catalog.get_product_by_slug(slug))
+
+
+@router.get("/products/{product_id}")
+def product_detail(product_id: int, request: Request):
+    return _product_response(request, catalog.get_product(product_id))
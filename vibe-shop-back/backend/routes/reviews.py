@@ -1,50 +1,152 @@
-from fastapi import APIRouter
-from schemas import ReviewIn, ReviewOut
-from config import DB_FILE
-import sqlite3
+from fastapi import APIRouter, HTTPException, Query
+from responses import FastJSONResponse
+from schemas import ReviewIn, ReviewOut, ReviewSummary
+from config import REVIEWS_BULK_MAX_IDS, REVIEWS_PAGE_SIZE, REVIEWS_PAGE_MAX
+from db import run_sqlite
+from typing import Optional
 import datetime
 
 router = APIRouter()
 
+_SUMMARY_SELECT = "SELECT product_id, count, sum, r1, r2, r3, r4, r5 FROM review_stats"
+
+
+def _parse_ids(ids: str) -> list[str]:
+    product_ids = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    if len(product_ids) > REVIEWS_BULK_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {REVIEWS_BULK_MAX_IDS} ids per request")
+    return product_ids
+
+
+def _summary(product_id: str, row) -> ReviewSummary:
+    if not row:
+        return ReviewSummary(product_id=product_id, count=0, average=None, histogram={n: 0 for n in range(1, 6)})
+    _, count, total, *hist = row
+    return ReviewSummary(
+        product_id=product_id,
+        count=count,
+        average=round(total / count, 2) if count else None,
+        histogram={n: c for n, c in zip(range(1, 6), hist)},
+    )
+
+
+def _summary_rows(con, product_ids: list[str]) -> list:
+    marks = ",".join("?" * len(product_ids))
+    return con.execute(f"{_SUMMARY_SELECT} WHERE product_id IN ({marks})", product_ids).fetchall()
+
+
+@router.get("/reviews/summary", response_model=list[ReviewSummary])
+async def get_reviews_summary_bulk(ids: str = Query(..., description="Comma-separated product ids")):
+    product_ids = _parse_ids(ids)
+    if not product_ids:
+        return []
+    rows = await run_sqlite(_summary_rows, product_ids)
+    by_id = {r[0]: r for r in rows}
+    return [_summary(pid, by_id.get(pid)) for pid in product_ids]
+
+
+@router.get("/reviews/{product_id}/summary", response_model=ReviewSummary)
+async def get_reviews_summary(product_id: str):
+    rows = await run_sqlite(_summary_rows, [str(product_id)])
+    return _summary(str(product_id), rows[0] if rows else None)
+
+
+def _review_row(r) -> dict:
+    rid, pid, rating, text, author, created_at = r
+    return {
+        "id": rid,
+        "product_id": pid,
+        "rating": int(rating) if rating is not None else 0,
+        "text": text or "",
+        "author": author,
+        "created_at": created_at or "",
+    }
+
+
+def _review_page(con, product_id: str, limit: Optional[int], before_id: Optional[int], min_rating: Optional[int]) -> list:
+    # Newest first along the reviews(product_id, id, rating) index
+    sql = "SELECT id, product_id, rating, text, author, created_at FROM reviews WHERE product_id = ?"
+    params: list = [product_id]
+    if before_id is not None:
+        sql += " AND id < ?"
+        params.append(before_id)
+    if min_rating is not None:
+        sql += " AND rating >= ?"
+        params.append(min_rating)
+    sql += " ORDER BY id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return con.execute(sql, params).fetchall()
+
+
+def _first_pages(con, product_ids: list[str], limit: int, min_rating: Optional[int]) -> dict:
+    return {pid: _review_page(con, pid, limit, None, min_rating) for pid in product_ids}
+
+
+@router.get("/reviews/batch")
+async def get_reviews_batch(
+    ids: str = Query(..., description="Comma-separated product ids"),
+    limit: int = Query(REVIEWS_PAGE_SIZE, ge=1, le=REVIEWS_PAGE_MAX),
+    min_rating: Optional[int] = Query(None, ge=1, le=5),
+):
+    """First page of reviews for each product id, keyed by id."""
+    pages = await run_sqlite(_first_pages, _parse_ids(ids), limit, min_rating)
+    return {
+        pid: {
+            "reviews": [_review_row(r) for r in rows],
+            "next_before_id": rows[-1][0] if len(rows) == limit else None,
+        }
+        for pid, rows in pages.items()
+    }
+
 
 @router.get("/reviews/{product_id}")
-def get_reviews(product_id: str):
-    con = sqlite3.connect(DB_FILE)
-    cur = con.cursor()
-    cur.execute(
-        "SELECT id, product_id, rating, text, author, created_at FROM reviews WHERE product_id = ? ORDER BY id DESC",
-        (str(product_id),)
+async def get_reviews(
+    product_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=REVIEWS_PAGE_MAX, description=f"Page size (default {REVIEWS_PAGE_SIZE} when paging)"),
+    before_id: Optional[int] = Query(None, description="Return reviews with id below this cursor"),
+    min_rating: Optional[int] = Query(None, ge=1, le=5),
+):
+    # Without limit/before_id this is the original unpaginated list the storefront reads
+    if limit is None and before_id is not None:
+        limit = REVIEWS_PAGE_SIZE
+    rows = await run_sqlite(_review_page, str(product_id), limit, before_id, min_rating)
+    headers = {}
+    if limit is not None and len(rows) == limit:
+        headers["X-Next-Cursor"] = str(rows[-1][0])
+    return FastJSONResponse(content=[_review_row(r) for r in rows], headers=headers)
+
+
+def _insert_review(con, product_id: str, rating: int, text: str, author: str, created_at: str) -> int:
+    cur = con.execute(
+        "INSERT INTO reviews (product_id, rating, text, author, created_at) VALUES (?, ?, ?, ?, ?)",
+        (product_id, rating, text, author, created_at)
+    )
+    # Keep the per-product aggregate in step with the insert (same transaction)
+    con.execute(
+        """
+        INSERT INTO review_stats (product_id, count, sum, r1, r2, r3, r4, r5)
+        VALUES (?, 1, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(product_id) DO UPDATE SET
+            count = count + 1,
+            sum = sum + excluded.sum,
+            r1 = r1 + excluded.r1,
+            r2 = r2 + excluded.r2,
+            r3 = r3 + excluded.r3,
+            r4 = r4 + excluded.r4,
+            r5 = r5 + excluded.r5
+        """,
+        (product_id, rating, *(int(rating == n) for n in range(1, 6))),
     )
-    rows = cur.fetchall()
-    con.close()
-    result = []
-    for r in rows:
-        rid, pid, rating, text, author, created_at = r
-        result.append({
-            "id": rid,
-            "product_id": pid,
-            "rating": int(rating) if rating is not None else 0,
-            "text": text or "",
-            "author": author,
-            "created_at": created_at or "",
-        })
-    return result
+    return cur.lastrowid
 
 
 @router.post("/reviews/{product_id}", response_model=ReviewOut)
-def add_review(product_id: str, body: ReviewIn):
+async def add_review(product_id: str, body: ReviewIn):
     author = body.author or "Гость"
     rating = max(1, min(int(body.rating), 5)) if isinstance(body.rating, int) else 5
     created_at = datetime.datetime.utcnow().isoformat()
 
-    con = sqlite3.connect(DB_FILE)
-    cur = con.cursor()
-    cur.execute(
-        "INSERT INTO reviews (product_id, rating, text, author, created_at) VALUES (?, ?, ?, ?, ?)",
-        (str(product_id), int(rating), body.text, author, created_at)
-    )
-    con.commit()
-    rid = cur.lastrowid
-    con.close()
+    rid = await run_sqlite(_insert_review, str(product_id), int(rating), body.text, author, created_at)
     return ReviewOut(id=rid, product_id=str(product_id), rating=int(rating), text=body.text, author=author, created_at=created_at)
-
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Literal, Optional
 
 
 class UserCreate(BaseModel):
@@ -17,6 +17,21 @@ class UserOut(BaseModel):
         orm_mode = True
 
 
+class RoleUpdate(BaseModel):
+    role: Literal["user", "admin"]
+
+
+class ProductUpdate(BaseModel):
+    name: Optional[str] = None
+    price: Optional[int] = Field(None, ge=0)
+    description: Optional[str] = None
+    slug: Optional[str] = Field(None, pattern=r"^[a-z0-9]+(?:-[a-z0-9]+)*$")
+
+
+class ProductBulkUpdate(ProductUpdate):
+    id: int
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -42,6 +57,7 @@ class CheckoutResponse(BaseModel):
     eta_days: Optional[int] = None
     eta_date: Optional[str] = None
     distance_km: Optional[int] = None
+    warehouse_id: Optional[str] = None
 
 
 class PayRequest(BaseModel):
@@ -57,6 +73,9 @@ class PayResponse(BaseModel):
     message: str
     transaction_id: Optional[str] = None
     delivery_time: Optional[str] = None
+    payment_id: Optional[int] = None
+    order_id: Optional[str] = None
+    warehouse_id: Optional[str] = None
 
 
 class DeliveryEtaRequest(BaseModel):
@@ -65,10 +84,15 @@ class DeliveryEtaRequest(BaseModel):
     items: list[Item]
 
 
+class DeliveryEtaBatchRequest(BaseModel):
+    destinations: list[DeliveryEtaRequest]
+
+
 class DeliveryEtaResponse(BaseModel):
     distance_km: int
     eta_days: int
     eta_date: str
+    warehouse_id: str
 
 
 class ReviewIn(BaseModel):
@@ -86,6 +110,13 @@ class ReviewOut(BaseModel):
     created_at: str
 
 
+class ReviewSummary(BaseModel):
+    product_id: str
+    count: int
+    average: Optional[float] = None
+    histogram: dict[int, int]
+
+
 class OrderItemOut(BaseModel):
     id: int
     name: str
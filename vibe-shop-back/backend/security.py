@@ -1,18 +1,22 @@
 import datetime
+import threading
+import time
+from collections import OrderedDict
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
 
-from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
-from db import SessionLocal, User
+from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, AUTH_CACHE_SIZE, AUTH_CACHE_MAX_AGE_S
+from db import get_db
+from passwords import hash_password, verify_password as _verify_password
+from schemas import UserOut
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
+# jose is imported on first use to keep app startup light
 def create_access_token(data: dict, expires_delta: int | None = None) -> str:
+    from jose import jwt
+
     to_encode = data.copy()
     expire = datetime.datetime.utcnow() + datetime.timedelta(
         minutes=expires_delta or ACCESS_TOKEN_EXPIRE_MINUTES
@@ -22,14 +26,84 @@ def create_access_token(data: dict, expires_delta: int | None = None) -> str:
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return _verify_password(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return hash_password(password)
+
+
+class TokenUserCache:
+    """Bounded LRU of verified token -> user, each entry expiring with its token."""
+
+    def __init__(self, maxsize: int, max_age: float):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[UserOut, float]] = OrderedDict()
+        self._tokens_by_user: dict[str, set[str]] = {}
+
+    def get(self, token: str) -> UserOut | None:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                self._drop(token)
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def put(self, token: str, user: UserOut, exp: float | None) -> None:
+        expires_at = time.time() + self.max_age
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        with self._lock:
+            if token in self._entries:
+                self._drop(token)
+            self._entries[token] = (user, expires_at)
+            self._tokens_by_user.setdefault(user.username, set()).add(token)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, username: str) -> None:
+        with self._lock:
+            for token in list(self._tokens_by_user.get(username, ())):
+                self._drop(token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def _drop(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[0].username)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[0].username]
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(lambda: SessionLocal())) -> User:
+user_cache = TokenUserCache(AUTH_CACHE_SIZE, AUTH_CACHE_MAX_AGE_S)
+
+
+def invalidate_user(username: str) -> None:
+    """Forget cached auth for a user, e.g. after their role changed."""
+    user_cache.invalidate_user(username)
+
+
+def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)) -> UserOut:
+    cached = user_cache.get(token)
+    if cached is not None:
+        return cached
+
+    from jose import JWTError, jwt
+    from users_db import User
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -41,11 +115,12 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     user = db.query(User).filter(User.username == username).first()
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    result = UserOut(id=user.id, username=user.username, role=user.role)
+    user_cache.put(token, result, payload.get("exp"))
+    return result
 
 
-def require_admin(user: User = Depends(get_current_user)) -> User:
+def require_admin(user: UserOut = Depends(get_current_user)) -> UserOut:
     if getattr(user, "role", None) != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     return user
-
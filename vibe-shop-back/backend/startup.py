@@ -0,0 +1,73 @@
+"""Startup-time report: how long imports and each lifespan phase took.
+
+main imports this module first, which starts the clock. Blocking phases run
+before the app accepts traffic; background phases (image sync, default admin
+user) are recorded when they finish. The report is logged once the app is
+ready and served at /admin/stats/startup.
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+
+# uvicorn's logger, so the report prints alongside the server's own startup lines
+logger = logging.getLogger("uvicorn.error")
+
+
+class StartupReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last_mark = self.started
+        self.phases: dict[str, float] = {}
+        self.background: dict[str, float | str] = {}
+        self.ready_ms: float | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _ms(seconds: float) -> float:
+        return round(seconds * 1000, 1)
+
+    def mark(self, name: str) -> None:
+        """Record the time since the previous mark (or process start of this report)."""
+        now = time.perf_counter()
+        self.phases[name] = self._ms(now - self._last_mark)
+        self._last_mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self._ms(time.perf_counter() - start)
+            self._last_mark = time.perf_counter()
+
+    def in_background(self, name: str, awaitable) -> asyncio.Task:
+        """Run `awaitable` without holding up startup, recording its duration."""
+        async def run():
+            start = time.perf_counter()
+            try:
+                await awaitable
+            except Exception as e:
+                self.background[name] = f"failed: {e!r}"
+                return
+            self.background[name] = self._ms(time.perf_counter() - start)
+
+        task = asyncio.get_running_loop().create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def ready(self) -> None:
+        self.ready_ms = self._ms(time.perf_counter() - self.started)
+        logger.info(
+            "Startup ready in %.1f ms: %s",
+            self.ready_ms,
+            ", ".join(f"{name} {ms:.1f} ms" for name, ms in self.phases.items()),
+        )
+
+    def as_dict(self) -> dict:
+        return {"ready_ms": self.ready_ms, "phases": dict(self.phases), "background": dict(self.background)}
+
+
+startup_report = StartupReport()
@@ -1,6 +1,8 @@
+import os
 import sys
 from pathlib import Path
 import json
+import pytest
 from fastapi.testclient import TestClient
 
 # Ensure project root is on the path
@@ -11,6 +13,25 @@ from backend.main import app
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def _isolated_databases(tmp_path, monkeypatch):
+    """Point the SQLite and users databases at tmp files so runs never touch the tracked ones."""
+    import db
+    import users_db
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    db_dir = tmp_path / "databases"
+    db_dir.mkdir()
+    monkeypatch.setattr(db, "DB_FILE", db_dir / "mock_payments.db")
+    engine = create_engine(f"sqlite:///{db_dir / 'users.db'}", connect_args={"check_same_thread": False})
+    users_db.Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(users_db, "engine", engine)
+    monkeypatch.setattr(users_db, "SessionLocal", sessionmaker(bind=engine))
+    yield
+    engine.dispose()
+
+
 def test_health():
     response = client.get("/health/live")
     assert response.status_code == 200
@@ -26,3 +47,768 @@ def test_products():
     with products_path.open("r", encoding="utf-8") as f:
         expected = json.load(f)
     assert data == expected
+
+
+def test_products_etag_not_modified():
+    first = client.get("/products")
+    etag = first.headers.get("etag")
+    assert etag and etag.startswith('"')
+    second = client.get("/products", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.content == b""
+
+
+def test_image_index_tracks_changes(tmp_path, monkeypatch):
+    import images
+
+    monkeypatch.setattr(images, "BACK_TEE_IMAGES_DIR", tmp_path)
+    for n in (2, 1, 10):
+        (tmp_path / f"7_{n}.jpg").write_bytes(b"x")
+    index = images.ImageIndex()
+    assert index.files(7) == ["7_1.jpg", "7_2.jpg", "7_10.jpg"]
+    assert index.next_index(7) == 11
+
+    (tmp_path / "7_11.png").write_bytes(b"x")
+    index.add("7_11.png")
+    (tmp_path / "7_1.jpg").unlink()
+    index.remove("7_1.jpg")
+    assert index.files("7") == ["7_2.jpg", "7_10.jpg", "7_11.png"]
+
+    # changes made behind the index's back are seen through the directory mtime
+    (tmp_path / "8_1.webp").write_bytes(b"x")
+    os.utime(tmp_path, ns=(0, 0))
+    assert index.urls_map()["8"] == ["/images/tees/images/8_1.webp"]
+
+
+def test_sqlite_conn_reuses_connection_and_rolls_back(tmp_path, monkeypatch):
+    import db
+
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "t.db")
+    with db.sqlite_conn() as con:
+        con.execute("CREATE TABLE t (x INTEGER)")
+        assert con.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    try:
+        with db.sqlite_conn() as con2:
+            assert con2 is con
+            con2.execute("INSERT INTO t VALUES (1)")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    with db.sqlite_conn() as con:
+        assert con.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+
+
+def test_admin_payments_keyset_pages_and_ndjson():
+    from security import require_admin
+
+    app.dependency_overrides[require_admin] = lambda: "admin"
+    try:
+        full = client.get("/admin/payments").json()
+        pages, after = [], None
+        while True:
+            params = {"limit": 7}
+            if after:
+                params["after"] = after
+            r = client.get("/admin/payments", params=params)
+            pages.extend(r.json())
+            after = r.headers.get("x-next-cursor")
+            if not after:
+                break
+        assert pages == full
+
+        r = client.get("/admin/payments", params={"format": "ndjson"})
+        assert r.headers["content-type"].startswith("application/x-ndjson")
+        assert [json.loads(line) for line in r.text.splitlines()] == full
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_my_orders_latest_payment_per_order(tmp_path, monkeypatch):
+    import db
+    from schemas import UserOut
+    from security import get_current_user
+
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "orders.db")
+    db.init_sqlite()
+    with db.sqlite_conn() as con:
+        for oid in ("A", "B", "C"):
+            con.execute(
+                "INSERT INTO orders (order_id, address, amount, created_at, username) VALUES (?, 'addr', 200, 't', 'alice')",
+                (oid,),
+            )
+            con.execute("INSERT INTO order_items (order_id, product_id, name, price, qty) VALUES (?, 1, 'Tee', 100, 2)", (oid,))
+        con.execute("INSERT INTO orders (order_id, amount, created_at, username) VALUES ('Z', 1, 't', 'bob')")
+        for oid, status in (("A", "declined"), ("A", "succeeded"), ("C", "declined")):
+            con.execute("INSERT INTO payments (order_id, status, created_at) VALUES (?, ?, 't')", (oid, status))
+
+    app.dependency_overrides[get_current_user] = lambda: UserOut(id=1, username="alice", role="user")
+    try:
+        r = client.get("/my-orders")
+    finally:
+        app.dependency_overrides.pop(get_current_user, None)
+    assert r.status_code == 200
+    data = r.json()
+    assert [o["order_id"] for o in data] == ["C", "B", "A"]
+    assert [o["payment_status"] for o in data] == ["declined", None, "succeeded"]
+    assert data[0]["items"] == [{"id": 1, "name": "Tee", "price": 100, "qty": 2}]
+
+
+def test_migrations_upgrade_legacy_db(tmp_path):
+    import sqlite3
+    import migrations
+
+    con = sqlite3.connect(tmp_path / "legacy.db")
+    con.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, order_id TEXT, address TEXT, items TEXT, amount INTEGER, created_at TEXT, geo_lat TEXT)")
+    con.execute(
+        "INSERT INTO orders (order_id, items) VALUES ('ORD-1', ?)",
+        ("[{'id': 3, 'name': 'Tee', 'price': 990, 'qty': 2}, {'id': 4, 'name': 'Cap', 'price': 500, 'qty': 1}]",),
+    )
+    con.commit()
+
+    assert migrations.migrate(con) == migrations.LATEST_VERSION
+    assert {"geo_lat", "geo_lon", "username"} <= migrations._columns(con, "orders")
+    indexes = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_orders_order_id", "idx_orders_username_id", "idx_payments_order_id_id", "idx_reviews_product_id_id_rating"} <= indexes
+    assert con.execute("SELECT order_id, product_id, name, price, qty FROM order_items ORDER BY id").fetchall() == [
+        ("ORD-1", 3, "Tee", 990, 2),
+        ("ORD-1", 4, "Cap", 500, 1),
+    ]
+    # already current: nothing re-applied
+    assert migrations.migrate(con) == migrations.LATEST_VERSION
+    assert con.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == len(migrations.MIGRATIONS)
+
+
+def test_review_summary_tracks_new_reviews(tmp_path, monkeypatch):
+    import db
+
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "reviews.db")
+    db.init_sqlite()
+    for rating in (5, 4, 5):
+        assert client.post("/reviews/42", json={"rating": rating, "text": "ok"}).status_code == 200
+
+    one = client.get("/reviews/42/summary").json()
+    assert one == {"product_id": "42", "count": 3, "average": 4.67, "histogram": {"1": 0, "2": 0, "3": 0, "4": 1, "5": 2}}
+    bulk = client.get("/reviews/summary", params={"ids": "42,7"}).json()
+    assert bulk[0] == one
+    assert bulk[1]["count"] == 0 and bulk[1]["average"] is None
+
+
+def test_reviews_keyset_pages_and_batch(tmp_path, monkeypatch):
+    import db
+    from routes import reviews
+
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "reviews.db")
+    monkeypatch.setattr(reviews, "REVIEWS_PAGE_SIZE", 2)
+    db.init_sqlite()
+    for rating in (1, 5, 2, 5, 4):
+        client.post("/reviews/9", json={"rating": rating, "text": "t"})
+    client.post("/reviews/10", json={"rating": 3, "text": "t"})
+
+    first = client.get("/reviews/9", params={"limit": 2})
+    assert [r["rating"] for r in first.json()] == [4, 5]
+    rest = client.get("/reviews/9", params={"limit": 2, "before_id": first.headers["x-next-cursor"]})
+    assert [r["rating"] for r in rest.json()] == [2, 5]
+    assert [r["rating"] for r in client.get("/reviews/9", params={"min_rating": 4}).json()] == [4, 5, 5]
+    # No paging parameters: the full list, as the storefront has always read it
+    everything = client.get("/reviews/9")
+    assert [r["rating"] for r in everything.json()] == [4, 5, 2, 5, 1] and "x-next-cursor" not in everything.headers
+    paged = client.get("/reviews/9", params={"before_id": everything.json()[0]["id"]})
+    assert [r["rating"] for r in paged.json()] == [5, 2] and paged.headers["x-next-cursor"]
+
+    batch = client.get("/reviews/batch", params={"ids": "9,10,11", "limit": 3}).json()
+    assert [r["rating"] for r in batch["9"]["reviews"]] == [4, 5, 2]
+    assert batch["9"]["next_before_id"] == batch["9"]["reviews"][-1]["id"]
+    assert batch["10"]["next_before_id"] is None and len(batch["10"]["reviews"]) == 1
+    assert batch["11"]["reviews"] == []
+
+
+def test_pay_mock_returns_at_once_and_settles_in_background(tmp_path, monkeypatch):
+    import db
+    import payments
+    from image_sync import image_sync
+
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "pay.db")
+    # Startup runs the image sync; keep it away from the real image directory
+    monkeypatch.setattr(image_sync, "src_dir", tmp_path / "front-images")
+    monkeypatch.setattr(image_sync, "manifest_path", tmp_path / "manifest.json")
+    monkeypatch.setattr(payments, "PAYMENT_LATENCY_MIN_S", 0.05)
+    monkeypatch.setattr(payments, "PAYMENT_LATENCY_MAX_S", 0.05)
+    db.init_sqlite()
+    with TestClient(app) as c:
+        order = c.post("/checkout", json={"address": "a", "items": [{"id": 1, "name": "Tee", "price": 10, "qty": 1}]}).json()
+        ok = c.post("/pay-mock", json={"order_id": order["order_id"], "card_number": "4111 1111 1111 1111", "exp_month": "01", "exp_year": "30", "name": "A B"})
+        declined = c.post("/pay-mock", json={"order_id": order["order_id"], "card_number": "4000000000009995", "exp_month": "01", "exp_year": "30", "name": "A B"})
+        assert ok.status_code == 202 and ok.json()["status"] == "pending"
+
+        done = c.get(f"/payments/{ok.json()['payment_id']}", params={"wait": 5}).json()
+        assert done["status"] == "succeeded" and done["transaction_id"] and done["delivery_time"]
+        assert c.get(f"/payments/{declined.json()['payment_id']}", params={"wait": 5}).json()["status"] == "declined"
+        assert c.get("/payments/999999").status_code == 404
+    with db.sqlite_conn() as con:
+        assert con.execute("SELECT eta_days FROM orders WHERE order_id = ?", (order["order_id"],)).fetchone()[0] >= 1
+        # Lines are stored once, in order_items
+        assert con.execute("SELECT items FROM orders WHERE order_id = ?", (order["order_id"],)).fetchone()[0] is None
+        assert con.execute("SELECT product_id, qty FROM order_items WHERE order_id = ?", (order["order_id"],)).fetchall() == [(1, 1)]
+        assert con.execute("SELECT COUNT(*) FROM payments WHERE latency_ms = 50").fetchone()[0] == 2
+
+
+def test_run_sqlite_uses_dedicated_executor(tmp_path, monkeypatch):
+    import asyncio
+    import threading
+    import db
+
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "exec.db")
+
+    def work(con):
+        con.execute("CREATE TABLE IF NOT EXISTS t (x)")
+        con.execute("INSERT INTO t VALUES (1)")
+        return threading.current_thread().name
+
+    assert asyncio.run(db.run_sqlite(work)).startswith("sqlite")
+    with db.sqlite_conn() as con:
+        assert con.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 1
+
+
+def test_current_user_is_cached_until_role_changes():
+    import uuid
+    from db import SessionLocal, User
+    from security import create_access_token, require_admin, user_cache
+
+    name = f"u-{uuid.uuid4().hex[:8]}"
+    with SessionLocal() as db:
+        db.add(User(username=name, password_hash="x", role="user"))
+        db.commit()
+    token = create_access_token({"sub": name, "role": "user"})
+    auth = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/me", headers=auth).json()["role"] == "user"
+    assert user_cache.get(token).username == name
+    assert client.get("/my-orders", headers=auth).status_code == 200
+
+    app.dependency_overrides[require_admin] = lambda: "admin"
+    try:
+        assert client.put(f"/admin/users/{name}/role", json={"role": "admin"}).status_code == 200
+    finally:
+        app.dependency_overrides.pop(require_admin, None)
+    assert user_cache.get(token) is None
+    assert client.get("/me", headers=auth).json()["role"] == "admin"
+
+
+def test_password_work_runs_in_process_pool():
+    import asyncio
+    import os
+    import passwords
+    from config import BCRYPT_ROUNDS
+
+    salt_and_digest = "a" * 21 + "e" + "b" * 31
+    assert passwords.pwd_context.needs_update(f"$2b$04${salt_and_digest}")
+    assert not passwords.pwd_context.needs_update(f"$2b${BCRYPT_ROUNDS:02d}${salt_and_digest}")
+    try:
+        assert asyncio.run(passwords._run(os.getpid)) != os.getpid()
+    finally:
+        passwords.close_password_pool()
+
+
+def test_delivery_eta_batch_matches_scalar():
+    import random
+    from types import SimpleNamespace
+    from warehouses import route_eta
+
+    rnd = random.Random(7)
+    destinations = [
+        {
+            "geo_lat": rnd.uniform(-89, 89),
+            "geo_lon": rnd.uniform(-179, 179),
+            "items": [{"id": rnd.randint(1, 9), "name": "Tee", "price": 100, "qty": rnd.randint(1, 4)} for _ in range(rnd.randint(0, 5))],
+        }
+        for _ in range(300)
+    ] + [{"geo_lat": 55.0084, "geo_lon": 82.9357, "items": []}]
+    r = client.post("/delivery-eta/batch", json={"destinations": destinations})
+    assert r.status_code == 200
+    for d, got in zip(destinations, r.json()):
+        items = [SimpleNamespace(**i) for i in d["items"]]
+        days, eta_date, distance, warehouse_id = route_eta(items, d["geo_lat"], d["geo_lon"])
+        assert got == {"distance_km": distance, "eta_days": days, "eta_date": eta_date, "warehouse_id": warehouse_id}
+
+
+def test_nearest_warehouse_with_stock():
+    import random
+    from types import SimpleNamespace
+    from utils import haversine_km
+    from warehouses import Warehouse, WarehouseIndex
+
+    rnd = random.Random(3)
+    whs = [Warehouse(str(i), str(i), rnd.uniform(-80, 80), rnd.uniform(-180, 180)) for i in range(200)]
+    index = WarehouseIndex(whs)
+    for _ in range(200):
+        lat, lon = rnd.uniform(-89, 89), rnd.uniform(-180, 180)
+        expected = min(whs, key=lambda w: haversine_km(lat, lon, w.lat, w.lon))
+        assert index.nearest(lat, lon) is expected
+
+    index = WarehouseIndex([
+        Warehouse("msk", "Москва", 55.7558, 37.6173, frozenset({1})),
+        Warehouse("nsk", "Новосибирск", 55.0084, 82.9357),
+    ])
+    tver = (56.8587, 35.9176)
+    assert index.for_order([SimpleNamespace(id=1, qty=1)], *tver).id == "msk"
+    assert index.for_order([SimpleNamespace(id=2, qty=1)], *tver).id == "nsk"
+
+    r = client.post("/delivery-eta", json={"geo_lat": tver[0], "geo_lon": tver[1], "items": []})
+    assert r.json()["warehouse_id"] == "msk"
+
+
+def test_eta_cache_hits_on_nearby_points_and_resets_daily():
+    import datetime
+    from types import SimpleNamespace
+    from security import require_admin
+    from warehouses import eta_cache, route_eta
+
+    eta_cache.clear()
+    cart = [SimpleNamespace(id=1, qty=2), SimpleNamespace(id=2, qty=1)]
+    same_shape = [SimpleNamespace(id=3, qty=3), SimpleNamespace(id=4, qty=0)]
+    first = eta_cache.route_eta(cart, 56.0101, 60.0)
+    assert first == route_eta(cart, 56.0101, 60.0)
+    # A few metres away, same cart shape: a hit, still exact for the given point
+    assert eta_cache.route_eta(same_shape, 56.01012, 60.0) == route_eta(same_shape, 56.01012, 60.0) == first
+    far = eta_cache.route_eta(cart, 56.2, 60.0)
+    assert far == route_eta(cart, 56.2, 60.0) and far[2] != first[2]
+    assert (eta_cache.hits, eta_cache.misses) == (1, 2)
+
+    eta_cache._day = datetime.date.today() - datetime.timedelta(days=1)
+    eta_cache.route_eta(cart, 56.0101, 60.0)
+    assert eta_cache.misses == 3 and eta_cache.stats()["size"] == 1
+
+    app.dependency_overrides[require_admin] = lambda: "admin"
+    try:
+        assert client.get("/admin/stats/eta-cache").json()["hits"] == 1
+    finally:
+        app.dependency_overrides.pop(require_admin, None)
+
+
+def test_image_variants_built_in_pool_and_listed(tmp_path, monkeypatch):
+    from PIL import Image
+    import variants
+
+    src_dir, out_dir = tmp_path / "images", tmp_path / "variants"
+    src_dir.mkdir()
+    Image.new("RGB", (900, 600), "red").save(src_dir / "7_1.jpg")
+    monkeypatch.setattr(variants, "BACK_TEE_IMAGES_DIR", src_dir)
+    monkeypatch.setattr(variants, "IMAGE_VARIANTS_DIR", out_dir)
+
+    index = variants.VariantIndex()
+    try:
+        built = sorted(name for future in index.schedule(["7_1.jpg"]) for name in future.result())
+    finally:
+        index.close()
+    assert built == ["7_1.jpg-320w.avif", "7_1.jpg-320w.webp", "7_1.jpg-640w.avif", "7_1.jpg-640w.webp"]
+    with Image.open(out_dir / "7_1.jpg-320w.webp") as im:
+        assert im.size == (320, 213)
+    assert index.srcsets("7_1.jpg")["webp"] == (
+        "/images/tees/variants/7_1.jpg-320w.webp 320w, /images/tees/variants/7_1.jpg-640w.webp 640w"
+    )
+    index.remove("7_1.jpg")
+    assert index.srcsets("7_1.jpg") == {} and not any(out_dir.iterdir())
+
+
+def test_image_variants_keep_same_stem_apart_and_formats_independent(tmp_path, monkeypatch):
+    from PIL import Image
+    import variants
+
+    src_dir, out_dir = tmp_path / "images", tmp_path / "variants"
+    src_dir.mkdir()
+    Image.new("RGB", (400, 300), "red").save(src_dir / "11.jpg")
+    Image.new("RGBA", (400, 300), "blue").save(src_dir / "11.png")  # JPEG cannot encode RGBA
+    monkeypatch.setattr(variants, "BACK_TEE_IMAGES_DIR", src_dir)
+    monkeypatch.setattr(variants, "IMAGE_VARIANTS_DIR", out_dir)
+    monkeypatch.setattr(variants, "IMAGE_VARIANT_FORMATS", {"jpeg": 80, "webp": 80})
+
+    with pytest.raises(OSError):
+        variants.build_variants(str(src_dir / "11.png"), str(out_dir), (320,), "jpeg", 80)
+    assert not any(out_dir.iterdir())  # the failed format leaves no temp files
+
+    index = variants.VariantIndex()
+    try:
+        for future in index.schedule(["11.jpg", "11.png"]):
+            future.exception()
+    finally:
+        index.close()
+    assert sorted(index.srcsets("11.jpg")) == ["jpeg", "webp"]
+    # The JPEG encode failed; the WebP build of the same original still landed
+    assert index.srcsets("11.png") == {"webp": "/images/tees/variants/11.png-320w.webp 320w"}
+    index.remove("11.png")
+    assert sorted(p.name for p in out_dir.iterdir()) == ["11.jpg-320w.jpeg", "11.jpg-320w.webp"]
+
+
+def test_image_upload_streams_to_disk_and_enforces_limits(tmp_path, monkeypatch):
+    import images
+    import variants
+    from routes import admin
+    from security import require_admin
+
+    for module in (admin, images, variants):
+        monkeypatch.setattr(module, "BACK_TEE_IMAGES_DIR", tmp_path)
+    monkeypatch.setattr(variants, "IMAGE_VARIANTS_DIR", tmp_path / "variants")
+    monkeypatch.setattr(admin, "UPLOAD_CHUNK_BYTES", 64)
+    monkeypatch.setattr(admin, "UPLOAD_MAX_FILE_BYTES", 300)
+    monkeypatch.setattr(admin, "UPLOAD_MAX_REQUEST_BYTES", 1000)
+    app.dependency_overrides[require_admin] = lambda: "admin"
+    try:
+        files = [("files", ("a.jpg", b"a" * 250, "image/jpeg")), ("files", ("b.PNG", b"b" * 200, "image/png"))]
+        r = client.post("/admin/products/9/images", files=files)
+        assert r.json()["saved"] == ["/images/tees/images/9_1.jpg", "/images/tees/images/9_2.png"]
+        assert (tmp_path / "9_1.jpg").read_bytes() == b"a" * 250
+
+        too_big = [("files", ("c.jpg", b"c" * 301, "image/jpeg"))]
+        assert client.post("/admin/products/9/images", files=too_big).status_code == 413
+        over_budget = [("files", (f"{n}.jpg", b"d" * 300, "image/jpeg")) for n in range(4)]
+        assert client.post("/admin/products/9/images", files=over_budget).status_code == 413
+    finally:
+        app.dependency_overrides.pop(require_admin, None)
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) == ["9_1.jpg", "9_2.png"]
+
+
+def test_upload_limits_apply_before_and_while_reading_the_body(tmp_path):
+    import asyncio
+    from fastapi import HTTPException, Request
+    from uploads import receive_files
+
+    head = b'--x\r\nContent-Disposition: form-data; name="files"; filename="a.jpg"\r\n\r\n'
+    reads = []
+
+    async def receive():
+        # An endless file part: the reader has to stop on its own
+        reads.append(1)
+        return {"type": "http.request", "body": head if len(reads) == 1 else b"z" * 100, "more_body": True}
+
+    def stage(headers):
+        scope = {"type": "http", "method": "POST", "path": "/", "query_string": b"",
+                 "headers": [(b"content-type", b"multipart/form-data; boundary=x"), *headers]}
+        limits = dict(max_file_bytes=10_000, max_request_bytes=1000, max_files=5, chunk_bytes=64)
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(receive_files(Request(scope, receive), tmp_path, (".jpg",), **limits))
+        return exc.value.status_code
+
+    # Declared too large: refused before any of the body is read
+    assert stage([(b"content-length", b"5000")]) == 413 and reads == []
+    # Undeclared (chunked): cut off once the limit is passed, nothing left on disk
+    assert stage([]) == 413 and len(reads) == 11
+    assert [p for p in tmp_path.iterdir() if p.is_file()] == []
+
+
+def test_hashed_image_urls_are_immutable_and_svgs_precompressed():
+    from images import hashed_url
+
+    url = hashed_url("/images/placeholder.svg")
+    assert url.startswith("/images/_h/") and url.endswith("/placeholder.svg")
+
+    r = client.get(url, headers={"Accept-Encoding": "br"})
+    assert r.status_code == 200
+    assert "immutable" in r.headers["cache-control"]
+    assert r.headers["content-encoding"] == "br" and r.headers["content-type"].startswith("image/svg+xml")
+    assert r.content == Path(__file__).resolve().parents[1].joinpath("public/images/placeholder.svg").read_bytes()
+
+    again = client.get(url, headers={"Accept-Encoding": "br", "If-None-Match": r.headers["etag"]})
+    assert again.status_code == 304
+
+    stale = client.get("/images/_h/0000000000000000/placeholder.svg", headers={"Accept-Encoding": "identity"})
+    assert stale.status_code == 200 and stale.headers["cache-control"] == "no-cache"
+    assert "content-encoding" not in stale.headers
+    assert client.get("/images/placeholder.svg").headers["cache-control"] == "no-cache"
+
+
+def test_responses_negotiate_compression():
+    from catalog import catalog
+
+    body, _ = catalog.get()
+    r = client.get("/products", headers={"Accept-Encoding": "br"})
+    assert r.headers["content-encoding"] == "br" and r.headers["etag"].endswith('-br"')
+    assert r.content == body
+    assert client.get("/products", headers={"Accept-Encoding": "br", "If-None-Match": r.headers["etag"]}).status_code == 304
+    assert "content-encoding" not in client.get("/products", headers={"Accept-Encoding": "identity"}).headers
+
+    # Dynamic responses go through the middleware, small ones stay uncompressed
+    big = client.post(
+        "/delivery-eta/batch",
+        json={"destinations": [{"geo_lat": 55.0, "geo_lon": 37.0, "items": []}] * 50},
+        headers={"Accept-Encoding": "gzip;q=1, br;q=0"},
+    )
+    assert big.headers["content-encoding"] == "gzip" and len(big.json()) == 50
+    small = client.get("/", headers={"Accept-Encoding": "br, gzip"})
+    assert "content-encoding" not in small.headers and small.json() == {"status": "ok"}
+
+
+def test_compressed_static_files_revalidate_and_pathsend_keeps_order(tmp_path):
+    import asyncio
+    from starlette.staticfiles import StaticFiles
+    from responses import CompressionMiddleware
+
+    (tmp_path / "notes.txt").write_text("x" * 4096)
+    static = TestClient(CompressionMiddleware(StaticFiles(directory=tmp_path)))
+    r = static.get("/notes.txt", headers={"Accept-Encoding": "br"})
+    assert r.headers["content-encoding"] == "br" and r.headers["etag"].endswith('-br"')
+    again = static.get("/notes.txt", headers={"Accept-Encoding": "br", "If-None-Match": r.headers["etag"]})
+    assert again.status_code == 304 and again.headers["etag"] == r.headers["etag"]
+    # A validator for another encoding does not match the brotli representation
+    other = r.headers["etag"].replace('-br"', '-gzip"')
+    assert static.get("/notes.txt", headers={"Accept-Encoding": "br", "If-None-Match": other}).status_code == 200
+
+    async def pathsend_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.pathsend", "path": str(tmp_path / "notes.txt")})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message["type"])
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", b"br")]}
+    asyncio.run(CompressionMiddleware(pathsend_app)(scope, None, send))
+    assert sent == ["http.response.start", "http.response.pathsend"]
+
+
+def test_product_ids_are_seeded_from_products_json(tmp_path, monkeypatch):
+    import db
+    import images
+    from config import DATA_FILE
+
+    # Whatever image groups the directory holds (say, a synced one numbered
+    # below the curated ones), ids come from the data file
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    for n in range(1, 7):
+        (image_dir / f"1000_{n}.jpg").write_bytes(b"x")
+    monkeypatch.setattr(images, "BACK_TEE_IMAGES_DIR", image_dir)
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "seed.db")
+    db.init_sqlite()
+    expected = [item["id"] for item in json.loads(DATA_FILE.read_text(encoding="utf-8"))]
+    with db.sqlite_conn() as con:
+        assert [r[0] for r in con.execute("SELECT id FROM products ORDER BY position")] == expected
+
+
+def test_products_table_row_and_bulk_updates(tmp_path, monkeypatch):
+    import db
+    from security import require_admin
+
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "catalog.db")
+    db.init_sqlite()
+    products = client.get("/products").json()
+    slugs = [p["slug"] for p in products]
+    assert len(set(slugs)) == len(slugs) == 16
+    first, second = products[0]["id"], products[1]["id"]
+
+    app.dependency_overrides[require_admin] = lambda: "admin"
+    try:
+        assert [p["slug"] for p in client.get("/admin/products").json()] == slugs
+        assert client.put(f"/admin/products/{first}", json={"price": 1}).status_code == 200
+        assert client.put("/admin/products/999999", json={"price": 1}).status_code == 404
+        assert client.put(f"/admin/products/{second}", json={"slug": slugs[0]}).status_code == 409
+
+        r = client.post("/admin/products/bulk-update", json=[{"id": second, "price": 2}, {"id": 999999, "price": 3}])
+        assert r.status_code == 404
+        r = client.post("/admin/products/bulk-update", json=[{"id": first, "name": "Renamed"}, {"id": second, "price": 2}])
+        assert r.json() == {"status": "ok", "updated": 2}
+    finally:
+        app.dependency_overrides.clear()
+
+    by_id = {p["id"]: p for p in client.get("/products").json()}
+    assert (by_id[first]["name"], by_id[first]["price"], by_id[first]["slug"]) == ("Renamed", 1, slugs[0])
+    assert by_id[second]["price"] == 2
+
+
+def test_product_search_ranks_pages_and_tracks_edits(tmp_path, monkeypatch):
+    import db
+    from security import require_admin
+
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "search.db")
+    db.init_sqlite()
+    body = client.get("/products/search", params={"q": "vibe", "min_price": 4000}).json()
+    assert body["total"] == 1 and body["items"][0]["price"] == 4290
+    assert sum(b["count"] for b in body["facets"]["price"]) == 16  # facets ignore the price filter
+
+    seen, cursor = [], None
+    while True:
+        params = {"sort": "price_desc", "limit": 5, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/products/search", params=params).json()
+        seen += [p["price"] for p in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert len(seen) == 16 and seen == sorted(seen, reverse=True)
+    assert client.get("/products/search", params={"cursor": "!!"}).status_code == 400
+
+    products = client.get("/products").json()
+    target = products[3]["id"]
+    unpriced = [p["id"] for p in products[:2]]
+    app.dependency_overrides[require_admin] = lambda: "admin"
+    try:
+        client.put(f"/admin/products/{target}", json={"name": "VIBE Tee Полночь", "description": "midnight cotton"})
+        for pid in unpriced:
+            client.put(f"/admin/products/{pid}", json={"price": None})
+    finally:
+        app.dependency_overrides.clear()
+
+    # Products without a price sort last and still page across the boundary
+    for sort in ("price_asc", "price_desc"):
+        seen, cursor = [], None
+        while True:
+            params = {"sort": sort, "limit": 5, **({"cursor": cursor} if cursor else {})}
+            page = client.get("/products/search", params=params).json()
+            seen += [(p["id"], p["price"]) for p in page["items"]]
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        assert len({pid for pid, _ in seen}) == 16
+        assert [pid for pid, price in seen[-2:]] == sorted(unpriced) and all(price is None for _, price in seen[-2:])
+    for q in ("полноч", "ПОЛНОЧЬ", "midnights"):
+        assert [p["id"] for p in client.get("/products/search", params={"q": q}).json()["items"]] == [target]
+
+
+def test_product_detail_by_id_and_slug_with_own_etag(tmp_path, monkeypatch):
+    import db
+    from security import require_admin
+
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "detail.db")
+    db.init_sqlite()
+    first, second = client.get("/products").json()[:2]
+
+    r = client.get(f"/products/{first['id']}")
+    assert r.json() == first
+    by_slug = client.get(f"/products/by-slug/{first['slug'].upper()}")
+    assert by_slug.json() == first and by_slug.headers["etag"] == r.headers["etag"]
+    assert client.get("/products/999999").status_code == 404
+    assert client.get("/products/by-slug/no-such-tee").status_code == 404
+
+    etag, other_etag = r.headers["etag"], client.get(f"/products/{second['id']}").headers["etag"]
+    assert etag != other_etag
+    assert client.get(f"/products/{first['id']}", headers={"If-None-Match": etag}).status_code == 304
+
+    app.dependency_overrides[require_admin] = lambda: "admin"
+    try:
+        client.put(f"/admin/products/{first['id']}", json={"price": first["price"] + 1})
+    finally:
+        app.dependency_overrides.clear()
+    assert client.get(f"/products/{first['id']}", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get(f"/products/{second['id']}", headers={"If-None-Match": other_etag}).status_code == 304
+
+
+def test_image_sync_copies_only_changes_and_keeps_admin_files(tmp_path, monkeypatch):
+    import os
+    import image_sync
+    from image_sync import ImageSync
+
+    src, dst = tmp_path / "front", tmp_path / "back"
+    src.mkdir()
+    dst.mkdir()
+    for name in ("1_1.jpg", "1_2.jpg", "2_1.png"):
+        (src / name).write_bytes(name.encode() * 100)
+    (src / "notes.txt").write_text("skip me")
+    (dst / "2_1.png").write_bytes(b"admin upload")
+    sync = ImageSync(src, dst, tmp_path / "manifest.json", workers=4)
+
+    first = sync.run()
+    assert (first["copied"], first["kept"]) == (2, 1)
+    assert sorted(p.name for p in dst.iterdir()) == ["1_1.jpg", "1_2.jpg", "2_1.png"]
+    assert (dst / "2_1.png").read_bytes() == b"admin upload"
+    hashed = []
+    real_sha256 = image_sync.file_sha256
+    monkeypatch.setattr(image_sync, "file_sha256", lambda path: hashed.append(path.name) or real_sha256(path))
+    again = sync.run()
+    assert (again["copied"], again["kept"]) == (0, 1) and hashed == []  # kept file not re-hashed
+
+    (dst / "2_1.png").write_bytes(b"another admin upload")
+    assert sync.run()["kept"] == 1 and hashed == ["2_1.png"]
+    assert (dst / "2_1.png").read_bytes() == b"another admin upload"
+
+    (src / "1_2.jpg").unlink()
+    (src / "1_2.jpg").write_bytes(b"new photo")
+    os.utime(src / "1_1.jpg", ns=(1, 1))  # touched, same content
+    (src / "3_1.webp").write_bytes(b"brand new")
+    (dst / "1_1.jpg").unlink()  # deleted by an admin: stays deleted
+    second = sync.run()
+    assert (second["copied"], second["unchanged"], second["kept"]) == (2, 0, 2)
+    assert (dst / "1_2.jpg").read_bytes() == b"new photo" and (dst / "3_1.webp").exists()
+    assert not (dst / "1_1.jpg").exists()
+    ignored = (tmp_path / ".gitignore").read_text().splitlines()
+    assert {"/back/1_2.jpg", "/back/3_1.webp"} <= set(ignored) and "/back/2_1.png" not in ignored
+
+    # Only catalog groups are synced; copies made for other groups are taken back out
+    (dst / "1_2.jpg").write_bytes(b"admin replacement")
+    sync.groups = lambda: {"2"}
+    narrowed = sync.run()
+    assert (narrowed["copied"], narrowed["removed"]) == (0, 1)
+    assert sorted(p.name for p in dst.iterdir()) == ["1_2.jpg", "2_1.png"]
+    assert not any(line.startswith("/back/") for line in (tmp_path / ".gitignore").read_text().splitlines())
+
+
+def test_import_is_light_and_lifespan_reports_phases(tmp_path, monkeypatch):
+    import subprocess
+    import db
+    from image_sync import image_sync
+    from startup import startup_report
+
+    probe = (
+        "import sys, main; "
+        "print(sorted(m for m in ('sqlalchemy', 'jose', 'passlib', 'numpy') if m in sys.modules))"
+    )
+    out = subprocess.run([sys.executable, "-c", probe], cwd=Path(__file__).resolve().parents[1], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
+
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "lifespan.db")
+    monkeypatch.setattr(image_sync, "src_dir", tmp_path / "front-images")
+    monkeypatch.setattr(image_sync, "manifest_path", tmp_path / "manifest.json")
+    with TestClient(app) as c:
+        assert c.get("/health/live").status_code == 200
+        with db.sqlite_conn() as con:
+            assert con.execute("SELECT COUNT(*) FROM products").fetchone()[0] == 16
+    report = startup_report.as_dict()
+    assert {"import fastapi", "import app modules", "sqlite migrations", "payment processor"} <= set(report["phases"])
+    assert report["ready_ms"] > 0
+
+
+def test_settle_is_idempotent_and_long_poll_releases_waiter(tmp_path, monkeypatch):
+    import db
+    import payments
+
+    monkeypatch.setattr(db, "DB_FILE", tmp_path / "settle.db")
+    db.init_sqlite()
+    with db.sqlite_conn() as con:
+        con.execute("INSERT INTO orders (order_id, amount, created_at) VALUES ('O', 1, 't')")
+        pid = con.execute("INSERT INTO payments (order_id, status, card_brand, created_at) VALUES ('O', 'pending', 'visa', 't')").lastrowid
+        payments.settle(con, pid, 0.01)
+        con.execute("UPDATE payments SET status = 'declined' WHERE id = ?", (pid,))
+        payments.settle(con, pid, 0.02)  # late duplicate
+        assert con.execute("SELECT status, latency_ms FROM payments WHERE id = ?", (pid,)).fetchone() == ("declined", 10)
+        pending = con.execute("INSERT INTO payments (order_id, status, created_at) VALUES ('O', 'pending', 't')").lastrowid
+
+    r = client.get(f"/payments/{pending}", params={"wait": 0.05})
+    assert r.json()["status"] == "pending"
+    assert pending not in payments.payment_processor._waiters
+
+
+def test_stale_variant_builds_are_not_published(tmp_path, monkeypatch):
+    from concurrent.futures import Future
+    from PIL import Image
+    import variants
+
+    src_dir, out_dir = tmp_path / "images", tmp_path / "variants"
+    src_dir.mkdir()
+    src = src_dir / "8_1.jpg"
+    Image.new("RGB", (400, 300), "blue").save(src)
+    monkeypatch.setattr(variants, "BACK_TEE_IMAGES_DIR", src_dir)
+    monkeypatch.setattr(variants, "IMAGE_VARIANTS_DIR", out_dir)
+    old_sig = variants.source_signature(src)
+
+    # Replaced while encoding: the worker throws its output away
+    assert variants.build_variants(str(src), str(out_dir), (320,), "webp", 80, (old_sig[0] + 1, old_sig[1])) == []
+    assert not any(out_dir.iterdir())
+
+    # Finished after a replacement: the index does not publish it
+    index = variants.VariantIndex()
+    index.refresh()
+    future = Future()
+    future.set_result(["8_1.jpg-320w.webp"])
+    version = index.version
+    index._built("8_1.jpg", "webp", (old_sig[0] + 1, old_sig[1]), future)
+    assert index.version == version
+    index._built("8_1.jpg", "webp", old_sig, future)
+    assert index.version > version
@@ -0,0 +1,168 @@
+"""Streaming multipart upload straight into staging files, with size limits.
+
+A `File(...)` parameter makes FastAPI read and spool the whole body before the
+handler runs, so limits checked there bound nothing. receive_files() instead
+rejects an oversized Content-Length before reading, then parses
+request.stream() itself: file parts are written to temp files in the target
+directory as they arrive, and the request is cut off with 413 as soon as a
+file or the body goes over its limit.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+class _Part:
+    def __init__(self):
+        self.headers: dict[bytes, bytes] = {}
+        self.filename: str | None = None
+        self.suffix = ""
+        self.file = None  # staging file, or None for skipped parts
+        self.size = 0
+        self.buffer = bytearray()
+        self.done = False
+
+
+class _StagingParser:
+    def __init__(self, dest_dir: Path, suffixes, max_file_bytes: int, max_files: int, chunk_bytes: int):
+        self.dest_dir = dest_dir
+        self.suffixes = suffixes
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.chunk_bytes = chunk_bytes
+        self.staged: list[tuple[str, str]] = []  # (temp path, suffix) in upload order
+        self.files = 0
+        self._part = _Part()
+        self._header_name = b""
+        self._header_value = b""
+        self._to_flush: list[_Part] = []
+
+    # python-multipart callbacks (sync; disk writes happen in flush())
+    def on_part_begin(self) -> None:
+        self._part = _Part()
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._part.headers[self._header_name.lower()] = self._header_value
+        self._header_name = self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._part.headers.get(b"content-disposition", b""))
+        if b"filename" not in options:
+            return
+        self.files += 1
+        if self.files > self.max_files:
+            raise HTTPException(status_code=413, detail=f"At most {self.max_files} files per upload")
+        part = self._part
+        part.filename = options[b"filename"].decode("utf-8", "replace")
+        part.suffix = Path(part.filename).suffix.lower()
+        if part.suffix in self.suffixes:
+            part.file = tempfile.NamedTemporaryFile(dir=self.dest_dir, prefix=".upload-", suffix=".part", delete=False)
+            self.staged.append((part.file.name, part.suffix))
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        part = self._part
+        if part.file is None:
+            return
+        part.size += end - start
+        if part.size > self.max_file_bytes:
+            raise HTTPException(status_code=413, detail=f"{part.filename}: file exceeds {self.max_file_bytes} bytes")
+        part.buffer += data[start:end]
+        if len(part.buffer) >= self.chunk_bytes and part not in self._to_flush:
+            self._to_flush.append(part)
+
+    def on_part_end(self) -> None:
+        if self._part.file is not None:
+            self._part.done = True
+            if self._part not in self._to_flush:
+                self._to_flush.append(self._part)
+
+    async def flush(self) -> None:
+        for part in self._to_flush:
+            data, part.buffer = bytes(part.buffer), bytearray()
+            await run_in_threadpool(_write_and_maybe_close, part.file, data, part.done)
+        self._to_flush.clear()
+
+    def discard(self) -> None:
+        for part in (self._part, *self._to_flush):
+            if part.file is not None:
+                part.file.close()
+        for path, _ in self.staged:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def _write_and_maybe_close(f, data: bytes, close: bool) -> None:
+    if data:
+        f.write(data)
+    if close:
+        f.close()
+        os.chmod(f.name, 0o644)  # mkstemp creates 0600
+
+
+async def receive_files(
+    request: Request,
+    dest_dir: Path,
+    suffixes,
+    *,
+    max_file_bytes: int,
+    max_request_bytes: int,
+    max_files: int,
+    chunk_bytes: int,
+) -> list[tuple[str, str]]:
+    """Stage every uploaded file whose suffix is in `suffixes`; returns [(temp path, suffix)].
+
+    The caller owns the returned files (move them into place or unlink them).
+    Raises 413 on any limit, leaving nothing behind.
+    """
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_request_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {max_request_bytes} bytes")
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    staging = _StagingParser(dest_dir, suffixes, max_file_bytes, max_files, chunk_bytes)
+    parser = MultipartParser(
+        boundary,
+        {
+            "on_part_begin": staging.on_part_begin,
+            "on_part_data": staging.on_part_data,
+            "on_part_end": staging.on_part_end,
+            "on_header_field": staging.on_header_field,
+            "on_header_value": staging.on_header_value,
+            "on_header_end": staging.on_header_end,
+            "on_headers_finished": staging.on_headers_finished,
+        },
+    )
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_request_bytes:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {max_request_bytes} bytes")
+            parser.write(chunk)
+            await staging.flush()
+        parser.finalize()
+        await staging.flush()
+    except FormParserError:
+        staging.discard()
+        raise HTTPException(status_code=400, detail="Invalid multipart body")
+    except BaseException:
+        staging.discard()
+        raise
+    return staging.staged
@@ -0,0 +1,24 @@
+"""SQLAlchemy users database.
+
+Imported on first use (see db.get_db), so app startup does not pay for
+loading SQLAlchemy; the table is created on that first import.
+"""
+from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from config import DATABASE_URL
+
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+SessionLocal = sessionmaker(bind=engine)
+Base = declarative_base()
+
+
+class User(Base):
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, unique=True, index=True)
+    password_hash = Column(String)
+    role = Column(String, default="user")
+
+
+Base.metadata.create_all(bind=engine)
@@ -1,42 +1,106 @@
 import datetime
+import gzip
 import json
 import math
 import re
-import shutil
 from pathlib import Path
 
+import brotli
 from fastapi import FastAPI
-from starlette.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
 
 from config import (
     BACK_IMAGES_ROOT,
-    BACK_TEE_IMAGES_DIR,
-    FRONT_TEE_IMAGES_DIR,
-    DATA_FILE,
     NOVOSIB,
+    STATIC_IMMUTABLE_MAX_AGE_S,
 )
+from images import content_hashes
 
 
-def ensure_images_synced() -> None:
+def precompress_svgs(root: Path = BACK_IMAGES_ROOT) -> None:
+    """Write .gz/.br siblings next to SVGs whose siblings are missing or stale."""
     try:
-        BACK_TEE_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-        back_has_any = any(BACK_TEE_IMAGES_DIR.glob("*"))
-        if (not back_has_any) and FRONT_TEE_IMAGES_DIR.exists():
-            for p in FRONT_TEE_IMAGES_DIR.iterdir():
-                if p.is_file() and re.search(r"\.(jpe?g|png|webp)$", p.name, flags=re.I):
-                    shutil.copy2(p, BACK_TEE_IMAGES_DIR / p.name)
-    except Exception:
-        pass
+        svgs = list(root.rglob("*.svg"))
+    except OSError:
+        return
+    for p in svgs:
+        try:
+            mtime = p.stat().st_mtime_ns
+            data = None
+            for ext, compress in ((".gz", lambda b: gzip.compress(b, 9, mtime=0)), (".br", brotli.compress)):
+                sibling = p.with_name(p.name + ext)
+                if sibling.exists() and sibling.stat().st_mtime_ns >= mtime:
+                    continue
+                data = p.read_bytes() if data is None else data
+                tmp = sibling.with_name(sibling.name + ".tmp")
+                tmp.write_bytes(compress(data))
+                tmp.replace(sibling)
+        except OSError:
+            continue
+
+
+_HASHED_PATH_RE = re.compile(r"^_h/([0-9a-f]{16})/(.+)$")
+_PRECOMPRESSED = {".svg": "image/svg+xml"}
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with a cache policy and precompressed siblings.
+
+    `_h/<hash>/<path>` (see images.hashed_url) serves <path>; when the hash
+    matches its current bytes the response is cacheable for a year as
+    immutable. Everything else gets `no-cache`, i.e. a cheap ETag/304
+    revalidation. SVGs are served from their .br/.gz siblings when the client
+    accepts that encoding.
+    """
+
+    async def get_response(self, path: str, scope) -> Response:
+        m = _HASHED_PATH_RE.match(path)
+        real = m.group(2) if m else path
+        response = self._precompressed(real, scope) or await super().get_response(real, scope)
+        if m and m.group(1) == content_hashes.get(Path(self.directory) / real):
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_IMMUTABLE_MAX_AGE_S}, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        if Path(real).suffix.lower() in _PRECOMPRESSED:
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    def _precompressed(self, path: str, scope) -> Response | None:
+        media_type = _PRECOMPRESSED.get(Path(path).suffix.lower())
+        if media_type is None or scope["method"] not in ("GET", "HEAD"):
+            return None
+        request_headers = Headers(scope=scope)
+        accepted = {e.split(";")[0].strip() for e in request_headers.get("accept-encoding", "").split(",")}
+        for encoding, ext in (("br", ".br"), ("gzip", ".gz")):
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = self.lookup_path(path + ext)
+            if stat_result is None:
+                continue
+            response = FileResponse(
+                full_path, stat_result=stat_result, media_type=media_type, headers={"Content-Encoding": encoding}
+            )
+            if self.is_not_modified(response.headers, request_headers):
+                return NotModifiedResponse(response.headers)
+            return response
+        return None
 
 
 def mount_images(app: FastAPI) -> None:
     try:
         BACK_IMAGES_ROOT.mkdir(parents=True, exist_ok=True)
-        app.mount("/images", StaticFiles(directory=str(BACK_IMAGES_ROOT)), name="images")
+        app.mount("/images", CachedStaticFiles(directory=str(BACK_IMAGES_ROOT)), name="images")
     except Exception:
         pass
 
 
+def slugify(name: str) -> str:
+    s = re.sub(r"[^a-zA-Z0-9]+", "-", name).strip("-")
+    return s.lower()
+
+
 def luhn_check(num: str) -> bool:
     if not num.isdigit():
         return False
@@ -79,21 +143,80 @@ def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     return 2 * R * math.asin(math.sqrt(a))
 
 
-def calc_eta(items: list, geo_lat: float | None, geo_lon: float | None) -> tuple[int, str, int]:
-    total_qty = sum(getattr(i, "qty", 0) for i in items) if items else 0
-    unique_ids = len({getattr(i, "id", None) for i in items}) if items else 0
-    distance = 0
-    if geo_lat is not None and geo_lon is not None:
-        try:
-            distance = int(round(haversine_km(geo_lat, geo_lon, NOVOSIB[0], NOVOSIB[1])))
-        except Exception:
-            distance = 0
+def eta_distance_km(geo_lat: float | None, geo_lon: float | None, origin: tuple[float, float] = NOVOSIB) -> int:
+    """Whole km from origin as calc_eta counts it; 0 without (usable) coordinates."""
+    if geo_lat is None or geo_lon is None:
+        return 0
+    try:
+        return int(round(haversine_km(geo_lat, geo_lon, origin[0], origin[1])))
+    except Exception:
+        return 0
+
+
+def eta_days(total_qty: int, unique_ids: int, distance: int) -> tuple[int, str]:
+    """(days, eta_date) for a cart shape and whole-km distance."""
     days = 1 + math.ceil(total_qty * 0.5) + math.ceil(unique_ids * 0.3) + math.ceil(distance / 700)
     days = max(1, min(days, 28))
     eta_date = (datetime.datetime.now() + datetime.timedelta(days=days)).strftime("%d.%m.%Y")
+    return days, eta_date
+
+
+def calc_eta(
+    items: list, geo_lat: float | None, geo_lon: float | None, origin: tuple[float, float] = NOVOSIB
+) -> tuple[int, str, int]:
+    total_qty = sum(getattr(i, "qty", 0) for i in items) if items else 0
+    unique_ids = len({getattr(i, "id", None) for i in items}) if items else 0
+    distance = eta_distance_km(geo_lat, geo_lon, origin)
+    days, eta_date = eta_days(total_qty, unique_ids, distance)
     return days, eta_date, distance
 
 
+def calc_eta_batch(
+    destinations: list[tuple[float, float, list]], origins: list[tuple[float, float]] | None = None
+) -> list[tuple[int, str, int]]:
+    """calc_eta over many (geo_lat, geo_lon, items) at once; same results, array math.
+
+    `origins` gives each destination's warehouse position (default NOVOSIB).
+    """
+    import numpy as np  # deferred: only batch ETAs need it
+
+    n = len(destinations)
+    if not n:
+        return []
+    # Missing coordinates become NaN and, like errors in calc_eta, distance 0
+    lat = np.fromiter((np.nan if d[0] is None else d[0] for d in destinations), dtype=np.float64, count=n)
+    lon = np.fromiter((np.nan if d[1] is None else d[1] for d in destinations), dtype=np.float64, count=n)
+    total_qty = np.fromiter((sum(getattr(i, "qty", 0) for i in d[2]) for d in destinations), dtype=np.float64, count=n)
+    unique_ids = np.fromiter((len({getattr(i, "id", None) for i in d[2]}) for d in destinations), dtype=np.float64, count=n)
+
+    if origins is None:
+        o_lat = np.full(n, NOVOSIB[0])
+        o_lon = np.full(n, NOVOSIB[1])
+    else:
+        o_lat = np.fromiter((o[0] for o in origins), dtype=np.float64, count=n)
+        o_lon = np.fromiter((o[1] for o in origins), dtype=np.float64, count=n)
+
+    # haversine_km with the same operation order as the scalar version
+    with np.errstate(invalid="ignore"):
+        d_lat = np.radians(o_lat - lat)
+        d_lon = np.radians(o_lon - lon)
+        a = np.sin(d_lat / 2) ** 2 + np.cos(np.radians(lat)) * np.cos(np.radians(o_lat)) * np.sin(d_lon / 2) ** 2
+        km = 2 * 6371.0 * np.arcsin(np.sqrt(a))
+    finite = np.isfinite(km)
+    # Vector sin/cos may differ from libm in the last bit; recompute the rare
+    # values that sit on a rounding boundary so round() agrees exactly
+    for k in np.flatnonzero(finite & (np.abs(km - np.floor(km) - 0.5) < 1e-9)):
+        km[k] = haversine_km(float(lat[k]), float(lon[k]), float(o_lat[k]), float(o_lon[k]))
+    distance = np.where(finite, np.rint(np.where(finite, km, 0.0)), 0.0)  # rint rounds half to even like round()
+
+    days = 1 + np.ceil(total_qty * 0.5) + np.ceil(unique_ids * 0.3) + np.ceil(distance / 700)
+    days = np.clip(days, 1, 28).astype(np.int64)
+
+    now = datetime.datetime.now()
+    dates = {int(d): (now + datetime.timedelta(days=int(d))).strftime("%d.%m.%Y") for d in np.unique(days)}
+    return [(d, dates[d], int(km_)) for d, km_ in zip(days.tolist(), distance.tolist())]
+
+
 def parse_items(items_raw: str):
     if items_raw is None:
         return []
@@ -0,0 +1,222 @@
+"""Resized WebP/AVIF derivatives of product images.
+
+Every original `<pid>_<n>.ext` gets `<pid>_<n>.ext-<width>w.<fmt>` files in
+IMAGE_VARIANTS_DIR for each configured width below its own (or one at its own
+width when it is smaller than all of them). The full original name is kept, so
+`11.jpg` and `11.png` never share files. Encoding is CPU-heavy, so it runs on a
+process pool after the upload response, one job per format (a failing AVIF
+encoder does not cost the WebP files); /products lists whatever variants exist
+as srcset strings and picks new ones up as they land.
+"""
+import functools
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+from config import (
+    BACK_TEE_IMAGES_DIR,
+    IMAGE_VARIANT_FORMATS,
+    IMAGE_VARIANT_WIDTHS,
+    IMAGE_VARIANT_WORKERS,
+    IMAGE_VARIANTS_DIR,
+)
+from images import hashed_url
+
+VARIANTS_URL_PREFIX = "/images/tees/variants/"
+
+_VARIANT_RE = re.compile(r"^(?P<original>.+\.[A-Za-z0-9]+)-(?P<width>\d+)w\.(?P<fmt>[a-z0-9]+)$")
+_PIL_FORMATS = {"avif": "AVIF", "webp": "WEBP", "jpeg": "JPEG", "png": "PNG"}
+
+
+def variant_name(name: str, width: int, fmt: str) -> str:
+    return f"{name}-{width}w.{fmt}"
+
+
+def source_signature(path) -> tuple[int, int] | None:
+    """(size, mtime_ns) of an original, or None if it is gone."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+def build_variants(src: str, out_dir: str, widths, fmt: str, quality: int, expected_sig: tuple | None = None) -> list[str]:
+    """Write every width of one original in one format; runs in a pool worker.
+
+    Returns the file names written. With `expected_sig`, nothing is published
+    (and [] returned) if the original was replaced or deleted while it was
+    being encoded. On an encoder error nothing of this format is left behind.
+    """
+    from PIL import Image, ImageOps
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    staged = []
+    try:
+        with Image.open(src) as im:
+            im = ImageOps.exif_transpose(im)
+            if im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+            targets = sorted(w for w in widths if w < im.width) or [im.width]
+            for width in targets:
+                height = max(1, round(im.height * width / im.width))
+                resized = im if width == im.width else im.resize((width, height), Image.LANCZOS)
+                name = variant_name(Path(src).name, width, fmt)
+                tmp = out / (name + ".tmp")
+                staged.append((tmp, name))
+                resized.save(tmp, format=_PIL_FORMATS[fmt], quality=quality)
+        if expected_sig is not None and source_signature(src) != tuple(expected_sig):
+            for tmp, _ in staged:
+                tmp.unlink(missing_ok=True)
+            return []
+    except BaseException:
+        for tmp, _ in staged:
+            tmp.unlink(missing_ok=True)
+        raise
+    for tmp, name in staged:
+        os.replace(tmp, out / name)
+    return [name for _, name in staged]
+
+
+class VariantIndex:
+    """original name -> {fmt: {width: file}} for the variants directory."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._dir_sig: tuple | None = None
+        self._by_original: dict[str, dict[str, dict[int, str]]] = {}
+        self._pool: ProcessPoolExecutor | None = None
+        self._pending: dict[tuple[str, str], Future] = {}  # (original name, fmt) -> latest queued build
+        self.version = 0
+
+    @property
+    def directory(self) -> Path:
+        return IMAGE_VARIANTS_DIR
+
+    def _stat_dir(self) -> tuple:
+        try:
+            return (str(self.directory), self.directory.stat().st_mtime_ns)
+        except OSError:
+            return (str(self.directory), None)
+
+    def _insert(self, name: str) -> None:
+        m = _VARIANT_RE.match(name)
+        if m and m.group("fmt") in IMAGE_VARIANT_FORMATS:
+            by_fmt = self._by_original.setdefault(m.group("original"), {})
+            by_fmt.setdefault(m.group("fmt"), {})[int(m.group("width"))] = name
+
+    def refresh(self) -> None:
+        """Rescan the directory if its mtime changed since the last look."""
+        sig = self._stat_dir()
+        if sig == self._dir_sig:
+            return
+        with self._lock:
+            if sig == self._dir_sig:
+                return
+            self._by_original = {}
+            try:
+                for p in self.directory.iterdir():
+                    self._insert(p.name)
+            except OSError:
+                pass
+            self._dir_sig = sig
+            self.version += 1
+
+    def srcsets(self, name: str) -> dict[str, str]:
+        """{fmt: "url 320w, url 640w"} for one original file name."""
+        self.refresh()
+        with self._lock:
+            by_fmt = self._by_original.get(name, {})
+            return {
+                fmt: ", ".join(f"{hashed_url(VARIANTS_URL_PREFIX + f)} {w}w" for w, f in sorted(files.items()))
+                for fmt, files in by_fmt.items()
+            }
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # forkserver: never fork the multi-threaded server
+                self._pool = ProcessPoolExecutor(
+                    max_workers=IMAGE_VARIANT_WORKERS, mp_context=multiprocessing.get_context("forkserver")
+                )
+            return self._pool
+
+    def _built(self, name: str, fmt: str, sig: tuple, future: Future) -> None:
+        with self._lock:
+            if self._pending.get((name, fmt)) is future:
+                del self._pending[(name, fmt)]
+        try:
+            names = future.result()
+        except Exception:
+            return  # undecodable upload or cancelled; the original is still served
+        if source_signature(BACK_TEE_IMAGES_DIR / name) != sig:
+            return  # the original changed after this build started; a newer one covers it
+        with self._lock:
+            self.refresh()
+            for variant in names:
+                self._insert(variant)
+            self._dir_sig = self._stat_dir()
+            self.version += 1
+
+    def schedule(self, names: list[str], missing_only: bool = False) -> list[Future]:
+        """Queue variant generation (one job per format) for originals in the tee image directory.
+
+        With `missing_only`, only formats an original has no variants in yet.
+        """
+        futures = []
+        for name in names:
+            sig = source_signature(BACK_TEE_IMAGES_DIR / name)
+            if sig is None:
+                continue
+            have = self.srcsets(name) if missing_only else {}
+            for fmt, quality in IMAGE_VARIANT_FORMATS.items():
+                if fmt in have:
+                    continue
+                future = self._get_pool().submit(
+                    build_variants,
+                    str(BACK_TEE_IMAGES_DIR / name),
+                    str(self.directory),
+                    IMAGE_VARIANT_WIDTHS,
+                    fmt,
+                    quality,
+                    sig,
+                )
+                with self._lock:
+                    previous, self._pending[(name, fmt)] = self._pending.get((name, fmt)), future
+                if previous is not None:
+                    previous.cancel()
+                future.add_done_callback(functools.partial(self._built, name, fmt, sig))
+                futures.append(future)
+        return futures
+
+    def remove(self, name: str) -> None:
+        """Delete the variants of an original that is going away."""
+        with self._lock:
+            for fmt in IMAGE_VARIANT_FORMATS:
+                pending = self._pending.pop((name, fmt), None)
+                if pending is not None:
+                    pending.cancel()  # not started yet; a running build checks the source itself
+            self.refresh()
+            by_fmt = self._by_original.pop(name, {})
+            for files in by_fmt.values():
+                for f in files.values():
+                    try:
+                        (self.directory / f).unlink()
+                    except OSError:
+                        pass
+            self._dir_sig = self._stat_dir()
+            self.version += 1
+
+    def close(self) -> None:
+        """Stop the encoder processes (shutdown)."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+variant_index = VariantIndex()
@@ -0,0 +1,182 @@
+"""Fulfilment warehouses and nearest-warehouse routing for delivery ETAs.
+
+Warehouses come from config.WAREHOUSES. They are indexed in a KD-tree over
+3-D unit vectors: straight-line distance between those ranks points the same
+way as great-circle distance, so the usual branch-and-bound search finds the
+nearest warehouse without lat/lon wrap-around problems.
+"""
+import datetime
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from config import ETA_CACHE_SIZE, ETA_CACHE_TTL_S, WAREHOUSES
+from utils import calc_eta, calc_eta_batch, eta_days, eta_distance_km
+
+
+class Warehouse(NamedTuple):
+    id: str
+    name: str
+    lat: float
+    lon: float
+    product_ids: frozenset | None = None  # None: carries the whole catalog
+
+    def stocks(self, product_ids: set) -> bool:
+        return self.product_ids is None or product_ids <= self.product_ids
+
+
+def _xyz(lat: float, lon: float) -> tuple[float, float, float]:
+    la, lo = math.radians(lat), math.radians(lon)
+    return (math.cos(la) * math.cos(lo), math.cos(la) * math.sin(lo), math.sin(la))
+
+
+class WarehouseIndex:
+    def __init__(self, warehouses):
+        self.warehouses = list(warehouses)
+        # node: (xyz, warehouse, axis, left, right)
+        self._root = self._build([(_xyz(w.lat, w.lon), w) for w in self.warehouses], 0)
+
+    def _build(self, points: list, depth: int):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        return (
+            points[mid][0],
+            points[mid][1],
+            axis,
+            self._build(points[:mid], depth + 1),
+            self._build(points[mid + 1:], depth + 1),
+        )
+
+    def nearest(self, lat: float, lon: float, accept=None) -> Warehouse | None:
+        """Closest warehouse to (lat, lon) among those `accept` (if given) allows."""
+        target = _xyz(lat, lon)
+        best: list = [None, math.inf]
+
+        def visit(node) -> None:
+            if node is None:
+                return
+            point, w, axis, left, right = node
+            d = (point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2 + (point[2] - target[2]) ** 2
+            if d < best[1] and (accept is None or accept(w)):
+                best[0], best[1] = w, d
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if diff * diff < best[1]:
+                visit(far)
+
+        visit(self._root)
+        return best[0]
+
+    def for_order(self, items: list, geo_lat: float | None, geo_lon: float | None) -> Warehouse:
+        """Nearest warehouse stocking every item; the nearest overall if none does.
+
+        Without coordinates, the first stocking warehouse in config order.
+        """
+        needed = {getattr(i, "id", None) for i in items or ()}
+        accept = lambda w: w.stocks(needed)  # noqa: E731
+        if geo_lat is None or geo_lon is None or not all(map(math.isfinite, (geo_lat, geo_lon))):
+            return next((w for w in self.warehouses if accept(w)), self.warehouses[0])
+        return self.nearest(geo_lat, geo_lon, accept) or self.nearest(geo_lat, geo_lon)
+
+
+warehouse_index = WarehouseIndex(
+    Warehouse(
+        id=w["id"],
+        name=w["name"],
+        lat=w["lat"],
+        lon=w["lon"],
+        product_ids=frozenset(w["product_ids"]) if w.get("product_ids") is not None else None,
+    )
+    for w in WAREHOUSES
+)
+
+
+def route_eta(items: list, geo_lat: float | None, geo_lon: float | None) -> tuple[int, str, int, str]:
+    """calc_eta from the warehouse that would ship the order: (days, date, km, warehouse_id)."""
+    w = warehouse_index.for_order(items, geo_lat, geo_lon)
+    days, eta_date, distance = calc_eta(items, geo_lat, geo_lon, origin=(w.lat, w.lon))
+    return days, eta_date, distance, w.id
+
+
+def route_eta_batch(destinations: list[tuple[float, float, list]]) -> list[tuple[int, str, int, str]]:
+    """route_eta for many (geo_lat, geo_lon, items) at once."""
+    chosen = [warehouse_index.for_order(items, lat, lon) for lat, lon, items in destinations]
+    results = calc_eta_batch(destinations, origins=[(w.lat, w.lon) for w in chosen])
+    return [(days, eta_date, distance, w.id) for (days, eta_date, distance), w in zip(results, chosen)]
+
+
+class EtaCache:
+    """LRU/TTL memo of the ETA arithmetic behind route_eta.
+
+    The shipping warehouse and the distance are worked out for the exact
+    destination on every call (a KD-tree walk and one haversine), so results
+    match route_eta. Days and eta_date depend only on the whole-km distance,
+    total qty and distinct item count, and that is what is cached. The cache
+    empties itself when the calendar date changes, since eta_date is relative
+    to today.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple] = OrderedDict()  # key -> ((days, eta_date), expires_at)
+        self._day = datetime.date.today()
+
+    def route_eta(self, items: list, geo_lat: float | None, geo_lon: float | None) -> tuple[int, str, int, str]:
+        """Cached route_eta: (days, date, km, warehouse_id)."""
+        w = warehouse_index.for_order(items, geo_lat, geo_lon)
+        distance = eta_distance_km(geo_lat, geo_lon, origin=(w.lat, w.lon))
+        items = items or []
+        total_qty = sum(getattr(i, "qty", 0) for i in items)
+        unique_ids = len({getattr(i, "id", None) for i in items})
+        key = (distance, total_qty, unique_ids)
+
+        now = time.monotonic()
+        today = datetime.date.today()
+        with self._lock:
+            if today != self._day:
+                self._entries.clear()
+                self._day = today
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return (*entry[0], distance, w.id)
+            self.misses += 1
+
+        days_date = eta_days(total_qty, unique_ids, distance)
+        with self._lock:
+            if self._day == today:
+                self._entries[key] = (days_date, now + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return (*days_date, distance, w.id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+eta_cache = EtaCache(ETA_CACHE_SIZE, ETA_CACHE_TTL_S)
@@ -25,6 +25,11 @@ export default defineConfig({
         target: 'http://127.0.0.1:8000',
         changeOrigin: true,
       },
+      // Content-hashed image URLs (/images/_h/<hash>/...) emitted by /products and variant srcsets
+      '/images/_h': {
+        target: 'http://127.0.0.1:8000',
+        changeOrigin: true,
+      },
     },
   },
 })